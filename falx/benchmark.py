@@ -0,0 +1,260 @@
+"""A reproducible synthesis benchmark runner over benchmarks/*.json.
+
+    python -m falx.benchmark run --out result.json [--benchmarks 001 002 ...] [--time-limit 60]
+    python -m falx.benchmark compare base.json result.json
+
+Each benchmark is run in a fresh process (so that peak memory is measured per benchmark and a
+stuck search can be killed), with traces sampled from the output visualization in the same way as
+utils/generate_random_traces.py. Sampling is seeded per benchmark and benchmark processes use a fixed
+hash seed (the search order depends on the iteration order of sets of strings), so runs are reproducible.
+"""
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+from falx.visualization.chart import VisDesign
+from falx.visualization import visual_trace
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+
+# extra time given to a benchmark process (to start up and to build vis designs) before it is killed
+PROCESS_GRACE_PERIOD_SEC = 60
+
+# a benchmark is only reported as slower if it is slower by both a ratio and an absolute amount
+MIN_TIME_DIFF_SEC = 0.5
+
+
+def sample_trace(full_trace, num_samples, rng):
+    """sample visual elements of each mark type from a full trace (with numpy RandomState rng, 
+        with replacement), half as many line and area segments are sampled since each of them 
+        shows two data points; returns the samples in the raw trace format (see visual_trace.load_trace)"""
+    partitioned = visual_trace.partition_trace(full_trace)
+
+    samples = []
+    for key in partitioned:
+        traces = partitioned[key]
+        k = int(np.ceil(num_samples / 2.0)) if key in ["Line", "Area"] else num_samples
+        indexes = rng.choice(list(range(len(traces))), k)
+        samples += [traces[i] for i in indexes]
+    return visual_trace.dump_trace(samples)
+
+
+def same_trace(tr1, tr2):
+    """check whether two traces contain the same visual elements (in any order)"""
+    return len(tr1) == len(tr2) and visual_trace.trace_contain(tr1, tr2) and visual_trace.trace_contain(tr2, tr1)
+
+
+def load_benchmark(path, num_samples, seed):
+    """load a benchmark file, returns its input tables, extra constants,
+        the sampled trace and the trace of the expected visualization"""
+    with open(path, "r") as f:
+        data = json.load(f)
+    vis = VisDesign.load_from_vegalite(data["vl_spec"], data["output_data"])
+    full_trace = vis.eval()
+    rng = np.random.RandomState(seed)
+    return {
+        "inputs": [data["input_data"]],
+        "extra_consts": data["constants"] if "constants" in data else [],
+        "raw_trace": sample_trace(full_trace, num_samples, rng),
+        "expected": full_trace
+    }
+
+
+def run_benchmark(path, config, num_samples, seed, profile=False):
+    """synthesize programs for a benchmark (in the current process), returns its result record
+        (with the profiler report of the request if profile is true)"""
+    from falx.interface import FalxInterface
+
+    bench = load_benchmark(path, num_samples, seed)
+    stats, report = {}, None
+    start = time.time()
+    # the search logs every candidate it evaluates
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        candidates = FalxInterface.synthesize(bench["inputs"], bench["raw_trace"], bench["extra_consts"],
+                                              config=config, stats=stats, profile=profile)
+    elapsed = time.time() - start
+    if profile:
+        candidates, report = candidates
+
+    # the benchmark is solved if some candidate reproduces the whole visualization
+    solved = False
+    for _, vis_design in candidates:
+        try:
+            if isinstance(vis_design, (VisDesign,)) and same_trace(vis_design.eval(), bench["expected"]):
+                solved = True
+                break
+        except Exception:
+            continue
+
+    result = {
+        "status": "solved" if solved else "unsolved",
+        "solved": solved,
+        "time": elapsed,
+        "num_explored": stats.get("num_explored", 0),
+        "num_candidates": len(candidates),
+    }
+    if report is not None:
+        result["profile"] = report["stages"]
+    return result
+
+
+def _benchmark_process(path, config, num_samples, seed, profile, queue):
+    from falx.interface import FalxInterface
+
+    try:
+        result = run_benchmark(path, config, num_samples, seed, profile)
+    except Exception as e:
+        result = {"status": "error", "solved": False, "error": repr(e)}
+    # worker pools of parallel searches (num_workers > 1) would keep the process from exiting
+    for pool in FalxInterface.worker_pools.values():
+        pool.shutdown()
+    # ru_maxrss is in kilobytes on linux
+    result["peak_memory_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    queue.put(result)
+
+
+def run_benchmark_in_process(path, config, num_samples, seed, profile=False):
+    """run a benchmark in a fresh process, it is killed if it does not finish within
+        its time limit (plus a grace period), returns its result record"""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_benchmark_process, args=(path, config, num_samples, seed, profile, queue))
+    start = time.time()
+    # the spawned process reads the hash seed from the environment when it starts, 
+    # the environment of this process is restored afterwards
+    previous_hash_seed = os.environ.get("PYTHONHASHSEED")
+    os.environ["PYTHONHASHSEED"] = str(seed)
+    try:
+        process.start()
+    finally:
+        if previous_hash_seed is None:
+            del os.environ["PYTHONHASHSEED"]
+        else:
+            os.environ["PYTHONHASHSEED"] = previous_hash_seed
+    timeout = config.get("time_limit_sec", 10) + PROCESS_GRACE_PERIOD_SEC
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = {"status": "killed", "solved": False, "time": time.time() - start}
+    process.join(timeout=PROCESS_GRACE_PERIOD_SEC)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+    return result
+
+
+def find_benchmarks(benchmark_dir, ids=None):
+    """benchmark files in benchmark_dir sorted by id: the given benchmark ids, 
+        or all benchmarks except discarded ones (e.g., 022_discard) if ids is None"""
+    paths = sorted(glob.glob(os.path.join(benchmark_dir, "*.json")))
+    bids = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+    if ids is not None:
+        return [p for p, bid in zip(paths, bids) if bid in ids]
+    return [p for p, bid in zip(paths, bids) if "discard" not in bid]
+
+
+def run(args):
+    config = json.loads(args.config) if args.config is not None else {}
+    config["time_limit_sec"] = args.time_limit
+
+    results = []
+    for path in find_benchmarks(args.benchmark_dir, args.benchmarks):
+        data_id = os.path.splitext(os.path.basename(path))[0]
+        result = run_benchmark_in_process(path, config, args.num_samples, args.seed, args.profile)
+        result["data_id"] = data_id
+        results.append(result)
+        print("{}\t{}\t{:.2f}s\t{} explored\t{:.1f}MB".format(data_id, result["status"], result.get("time", 0),
+                result.get("num_explored", 0), result.get("peak_memory_mb", 0)), file=sys.stderr)
+
+    summary = {"config": config, "num_samples": args.num_samples, "seed": args.seed, "results": results}
+    with open(args.out, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print("# solved: {} / {}".format(len([r for r in results if r["solved"]]), len(results)))
+
+
+def compare_results(base, new, time_tolerance=0.2, memory_tolerance=0.2):
+    """compare two result files (in the format written by run),
+        returns a list of regressions and a list of improvements (as readable strings)"""
+    base_results = {r["data_id"]: r for r in base["results"]}
+    regressions, improvements = [], []
+    for r in new["results"]:
+        data_id = r["data_id"]
+        if data_id not in base_results:
+            continue
+        b = base_results[data_id]
+        if b["solved"] and not r["solved"]:
+            regressions.append(f"{data_id}: no longer solved ({r['status']})")
+            continue
+        if not b["solved"] and r["solved"]:
+            improvements.append(f"{data_id}: newly solved")
+            continue
+        if not (b["solved"] and r["solved"]):
+            continue
+        if r["time"] > b["time"] * (1 + time_tolerance) and r["time"] - b["time"] > MIN_TIME_DIFF_SEC:
+            regressions.append(f"{data_id}: time {b['time']:.2f}s -> {r['time']:.2f}s")
+        elif b["time"] > r["time"] * (1 + time_tolerance) and b["time"] - r["time"] > MIN_TIME_DIFF_SEC:
+            improvements.append(f"{data_id}: time {b['time']:.2f}s -> {r['time']:.2f}s")
+        if "peak_memory_mb" in b and "peak_memory_mb" in r and r["peak_memory_mb"] > b["peak_memory_mb"] * (1 + memory_tolerance):
+            regressions.append(f"{data_id}: peak memory {b['peak_memory_mb']:.1f}MB -> {r['peak_memory_mb']:.1f}MB")
+    return regressions, improvements
+
+
+def compare(args):
+    with open(args.base, "r") as f:
+        base = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+
+    if (base.get("num_samples"), base.get("seed")) != (new.get("num_samples"), new.get("seed")):
+        print("[warning] the result files are sampled with different settings", file=sys.stderr)
+
+    regressions, improvements = compare_results(base, new, args.time_tolerance, args.memory_tolerance)
+    print("# solved: {} -> {}".format(len([r for r in base["results"] if r["solved"]]),
+                                       len([r for r in new["results"] if r["solved"]])))
+    for msg in improvements:
+        print("[improvement] " + msg)
+    for msg in regressions:
+        print("[regression] " + msg)
+
+    # a non-zero exit code lets scripts catch regressions
+    return 1 if len(regressions) > 0 else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run and compare falx synthesis benchmarks.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run benchmarks and write the results into a json file")
+    run_parser.add_argument("--out", required=True, help="the result file")
+    run_parser.add_argument("--benchmark-dir", default=BENCHMARK_DIR)
+    run_parser.add_argument("--benchmarks", nargs="*", default=None, help="benchmark ids (default: all)")
+    run_parser.add_argument("--time-limit", type=float, default=60, help="time limit per benchmark (seconds)")
+    run_parser.add_argument("--num-samples", type=int, default=4, help="number of visual elements sampled per mark")
+    run_parser.add_argument("--seed", type=int, default=2019)
+    run_parser.add_argument("--config", default=None, help="synthesizer config (json) passed to FalxInterface")
+    run_parser.add_argument("--profile", action="store_true", help="record the time spent in each stage of synthesis")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--time-tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    compare_parser.add_argument("--memory-tolerance", type=float, default=0.2, help="allowed relative memory growth")
+
+    args = parser.parse_args(argv)
+    if args.mode == "run":
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,18 @@
 import json
-import itertools
 from pprint import pprint
 import numpy as np
 import copy
+import concurrent.futures
+import heapq
 
 from falx.table import synthesizer as table_synthesizer
+from falx.table import eval_cache
 
-from falx.utils import synth_utils
 from falx.utils import eval_utils
 from falx.utils import vis_utils
+from falx.utils.deadline import Deadline
+from falx.utils.profiler import (Profiler, get_active_profiler, activate as activate_profiler, 
+    profile as profile_stage)
 
 from falx.visualization.chart import VisDesign
 from falx.visualization.matplotlib_chart import MatplotlibChart
@@ -32,6 +36,12 @@ class FalxInterface(object):
         "time_limit_sec": 10,
         "max_prog_size": 2,
 
+        # number of worker processes used to explore sketches in parallel (1 means sequential search)
+        "num_workers": 1,
+
+        # the maximum number of combinations of layer programs returned for a multi-layer chart
+        "layer_combination_limit": 100,
+
         "grammar": {
             "operators": ["select", "unite", "filter", "separate", "spread", 
                 "gather", "gather_neg", "group_sum", "cumsum", "mutate", "mutate_custom"],
@@ -40,7 +50,14 @@ class FalxInterface(object):
             "aggr_func": ["mean", "sum", "count"],
             "mutate_op": ["+", "-"],
             "gather_max_val_list_size": 3,
-            "gather_max_key_list_size": 3
+            "gather_max_key_list_size": 3,
+            # "depth_first" explores sketches one after another, 
+            # "best_first" interleaves partial programs from all sketches by the cost model
+            "search_strategy": "depth_first",
+            "cost_model": "estimated",
+            # the table engine used to evaluate candidates during the search: "pandas" or "micro" 
+            # (a light column-oriented engine for small tables), final results are always evaluated by pandas
+            "table_backend": "pandas"
         },
 
         # set the visualization backend, one of "vegalite, ggplot2, matplotlib"
@@ -48,17 +65,47 @@ class FalxInterface(object):
         "vis_backend": "vegalite"
     }
 
-    def group_results(results):
-        """Given a list of candidate program, evaluate them and group them into equivalence classes."""
+    def group_results(results, num_workers=1):
+        """Given a list of candidate program, evaluate them and group them into equivalence classes.
+            Candidates are equivalent if their traces contain the same visual elements (in any order), 
+            traces are bucketed by an order-independent hash (see visual_trace.multiset_hash) and 
+            only compared element by element within a bucket. Traces are evaluated by the shared 
+            worker pool with num_workers processes if num_workers > 1. 
+            Classes are keyed by the hash of their traces (as a hex string)."""
+        vis_specs = [vis_spec for _, vis_spec in results]
+        if num_workers > 1 and len(vis_specs) > 1:
+            executor = FalxInterface.get_worker_pool(num_workers).executor
+            multisets = list(executor.map(_eval_trace_multiset, vis_specs, 
+                                          chunksize=max(1, len(vis_specs) // (num_workers * 4))))
+        else:
+            multisets = [_eval_trace_multiset(vis_spec) for vis_spec in vis_specs]
+
         equiv_classes = {}
-        for tbl_prog, vis_spec in results:
-            full_trace = vis_spec.eval()
-            fronzen_trace = json.dumps(visual_trace.trace_to_table(full_trace), sort_keys=True)
-            if fronzen_trace not in equiv_classes:
-                equiv_classes[fronzen_trace] = []
-            equiv_classes[fronzen_trace].append((tbl_prog, vis_spec))
+        # multiset hash -> [(multiset, key)] of classes whose traces have the hash
+        buckets = {}
+        for (tbl_prog, vis_spec), multiset in zip(results, multisets):
+            h = visual_trace.multiset_hash(multiset)
+            bucket = buckets.setdefault(h, [])
+            keys = [key for m, key in bucket if m == multiset]
+            if len(keys) > 0:
+                key = keys[0]
+            else:
+                # distinct traces with the same hash are told apart by a suffix
+                key = "{:016x}".format(h) if len(bucket) == 0 else "{:016x}-{}".format(h, len(bucket))
+                bucket.append((multiset, key))
+                equiv_classes[key] = []
+            equiv_classes[key].append((tbl_prog, vis_spec))
         return equiv_classes
 
+    # sketch worker pools shared by parallel searches, indexed by the number of workers
+    worker_pools = {}
+
+    def get_worker_pool(num_workers):
+        """get the worker pool with num_workers processes, it is created on first use and reused afterwards"""
+        if num_workers not in FalxInterface.worker_pools:
+            FalxInterface.worker_pools[num_workers] = table_synthesizer.SketchWorkerPool(num_workers)
+        return FalxInterface.worker_pools[num_workers]
+
     def update_config(user_config):
         config = copy.copy(FalxInterface.default_config)
         for key in user_config:
@@ -71,11 +118,14 @@ class FalxInterface(object):
         assert config["solution_limit"] >= 1
         assert config["time_limit_sec"] > 0
         assert config["max_prog_size"] >= 0
+        assert config["num_workers"] >= 1
+        assert config["layer_combination_limit"] >= 1
+        assert config["num_workers"] == 1 or config["grammar"].get("search_strategy", "depth_first") == "depth_first"
 
         return config
 
     @staticmethod
-    def synthesize(inputs, raw_trace, extra_consts=[], group_results=False, config={}):
+    def synthesize(inputs, raw_trace, extra_consts=[], group_results=False, config={}, stats=None, profile=False):
         """synthesize table prog and vis prog from input and output traces
         Inputs:
             input tables: a list of input tables that the synthesizer will take into consideration
@@ -92,19 +142,79 @@ class FalxInterface(object):
                       "starting_search_program_length": 1, "stop_search_program_length": 2,
                       "grammar_base_file": "dsl/tidyverse.tyrell.base",
                       "block_sketches": [], "block_program_symbols": [], "vis_backend": "vegalite" }
+            stats: a dict that receives search statistics (e.g., stats["num_explored"], 
+                    the number of candidate programs explored by the table synthesizers)
+            profile: whether to profile the request, if it is true, a report is returned with the candidates:
+                    (candidates, {"num_explored": ..., "stages": {stage: {"count": ..., "time_sec": ..., "self_time_sec": ...}}})
+                    stages include inv_eval, enum_sketches, backward_eval, infer_domain.<op>, eval.<op>, 
+                    shape_check, premise_check, align_table_schema and vis_post_processing (see utils.profiler)
         """
+        request_profiler = Profiler() if profile else None
+        if profile and stats is None:
+            stats = {}
+
+        candidates = list(FalxInterface.synthesize_iter(inputs, raw_trace, extra_consts, config, 
+                                                        stats=stats, profiler=request_profiler))
+
+        if group_results:
+            with activate_profiler(request_profiler), profile_stage("group_results"):
+                candidates = FalxInterface.group_results(candidates, 
+                                config.get("num_workers", FalxInterface.default_config["num_workers"]))
+
+        if profile:
+            return candidates, {"num_explored": stats.get("num_explored", 0), "stages": request_profiler.report()}
+
+        return candidates
+
+    @staticmethod
+    def synthesize_iter(inputs, raw_trace, extra_consts=[], config={}, cache=None, worker_pool=None, stats=None, 
+                        profiler=None):
+        """a generator version of synthesize: (table prog, vis design) pairs are yielded as soon as 
+            the table program is confirmed, the search only proceeds as far as the consumer pulls 
+            (see synthesize for the arguments, cache is passed to table synthesizers 
+             to share evaluated sub-programs across requests, worker_pool is used by parallel 
+             searches and defaults to the shared pool with config["num_workers"] processes,
+             profiler is a utils.profiler.Profiler that records the stages of the search)"""
+        synthesizers = []
+        gen = FalxInterface._synthesize_iter(inputs, raw_trace, extra_consts, config, 
+                                             cache, worker_pool, synthesizers)
+        try:
+            while True:
+                # the profiler is only active while the search runs (not while the consumer holds a result)
+                with activate_profiler(profiler):
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            # statistics are also recorded if the consumer stops early
+            if stats is not None:
+                stats["num_explored"] = stats.get("num_explored", 0) + sum([s.num_explored for s in synthesizers])
+
+    @staticmethod
+    def _synthesize_iter(inputs, raw_trace, extra_consts, config, cache, worker_pool, synthesizers):
+        """the search of synthesize_iter, table synthesizers created are appended to synthesizers"""
 
         # update synthesizer config
         config = FalxInterface.update_config(config)
 
+        if worker_pool is None and config["num_workers"] > 1:
+            worker_pool = FalxInterface.get_worker_pool(config["num_workers"])
+
+        # all searches of the request read the same inputs, so they share one evaluation cache
+        if cache is None:
+            cache = eval_cache.EvalCache()
+
         example_trace = visual_trace.load_trace(raw_trace)
 
         # apply inverse semantics to obtain symbolic output table and vis programs
         abstract_designs = None
-        if config["vis_backend"] == "vegalite":
-            abstract_designs = VisDesign.inv_eval(example_trace)  
-        else:
-            abstract_designs = MatplotlibChart.inv_eval(example_trace)
+        with profile_stage("inv_eval"):
+            if config["vis_backend"] == "vegalite":
+                abstract_designs = VisDesign.inv_eval(example_trace)  
+            else:
+                abstract_designs = MatplotlibChart.inv_eval(example_trace)
         
         # sort pairs based on complexity of tables
         abstract_designs.sort(key=lambda x: len(x[0].values[0]) 
@@ -113,77 +223,195 @@ class FalxInterface(object):
         logger.info("# Synthesizer configuration")
         logger.info(json.dumps(config, indent=2))
 
-        candidates = []
+        # the time limit covers the whole request, abstract designs share the remaining time
+        deadline = Deadline(config["time_limit_sec"])
+
         for sym_data, chart in abstract_designs:
 
+            if deadline.expired():
+                break
+
             # split case based on single layered chart or multi layered chart
             if not isinstance(sym_data, (list,)):
                 # single-layer chart
 
-                synthesizer = table_synthesizer.Synthesizer(config=config["grammar"])
+                synthesizer = table_synthesizer.Synthesizer(config=config["grammar"], 
+                                    cache=cache, worker_pool=worker_pool)
+                synthesizers.append(synthesizer)
 
                 print(sym_data.instantiate())
 
-                candidate_progs = synthesizer.enumerative_synthesis(
-                                    inputs, sym_data.instantiate(), 
-                                    max_prog_size=config["max_prog_size"],
-                                    time_limit_sec=config["time_limit_sec"],
-                                    solution_limit=config["solution_limit"])
-
-                for p in candidate_progs:
-                    output = p.eval(inputs).to_dict(orient="records")
-
-                    field_mapping = synth_utils.align_table_schema(sym_data.values, output)
-                    assert(field_mapping != None)
-
-                    if config["vis_backend"] == "vegalite":
-                        vis_design = VisDesign(data=output, chart=copy.deepcopy(chart))
-                        vis_design.update_field_names(field_mapping)
-                        candidates.append((p.stmt_string(), vis_design))
-                    else:
-                        vis_design = MatplotlibChart(output, copy.deepcopy(chart))
-                        candidates.append((p.stmt_string(), vis_design.to_string_spec(field_mapping)))
+                # solutions carry the output table and the field mapping computed by the search
+                candidate_solutions = synthesizer.enumerative_synthesis_iter(
+                                        inputs, sym_data.instantiate(), 
+                                        max_prog_size=config["max_prog_size"],
+                                        time_limit_sec=deadline.remaining(),
+                                        solution_limit=config["solution_limit"],
+                                        num_workers=config["num_workers"],
+                                        return_solutions=True)
+
+                for solution in candidate_solutions:
+                    with profile_stage("vis_post_processing"):
+                        p, output, field_mapping = solution.program, solution.output, solution.field_mapping
+
+                        if config["vis_backend"] == "vegalite":
+                            vis_design = VisDesign(data=output, chart=copy.deepcopy(chart))
+                            vis_design.update_field_names(field_mapping)
+                            result = (p.stmt_string(), vis_design)
+                        else:
+                            vis_design = MatplotlibChart(output, copy.deepcopy(chart))
+                            result = (p.stmt_string(), vis_design.to_string_spec(field_mapping))
+                    yield result
             else:
-                synthesizer = table_synthesizer.Synthesizer(config=config["grammar"])
+                layer_synthesizers = [table_synthesizer.Synthesizer(config=config["grammar"], 
+                                        cache=cache, worker_pool=worker_pool) for d in sym_data]
+                synthesizers.extend(layer_synthesizers)
 
                 # multi-layer charts
-                # layer_candidate_progs[i] contains all programs that transform inputs to output[i]
+                # layer_candidate_solutions[i] contains all programs that transform inputs to output[i], 
+                # each of them carries its output table and field mapping, which are shared by combinations
                 # synthesize table transformation programs for each layer
-                layer_candidate_progs = [synthesizer.enumerative_synthesis(
-                                            inputs, d.instantiate(), 
-                                            max_prog_size=config["max_prog_size"], 
-                                            time_limit_sec=config["time_limit_sec"],
-                                            solution_limit=config["solution_limit"]) for d in sym_data]
-                
+                layer_candidate_solutions = FalxInterface.synthesize_layers(layer_synthesizers, inputs, sym_data, 
+                                                                            config, deadline)
 
-                # iterating over combinations for different layers
-                layer_id_lists = [list(range(len(l))) for l in layer_candidate_progs]
-                for layer_id_choices in itertools.product(*layer_id_lists):
+                # iterating over combinations for different layers, from combinations of top ranked programs
+                layer_sizes = [len(l) for l in layer_candidate_solutions]
+                for layer_id_choices in FalxInterface.ranked_combinations(layer_sizes, config["layer_combination_limit"]):
 
-                    #layer_prog[i] is the transformation program for the i-th layer
-                    progs = [layer_candidate_progs[i][layer_id_choices[i]] for i in range(len(layer_id_choices))]
+                    #layer_solutions[i] is the solution (transformation program) for the i-th layer
+                    layer_solutions = [layer_candidate_solutions[i][layer_id_choices[i]] for i in range(len(layer_id_choices))]
+                    progs = [sol.program for sol in layer_solutions]
 
-                    # apply each program on inputs to get output table for each layer
-                    outputs = [p.eval(inputs).to_dict(orient="records") for p in progs]
+                    with profile_stage("vis_post_processing"):
+                        outputs = [sol.output for sol in layer_solutions]
+                        field_mappings = [sol.field_mapping for sol in layer_solutions]
 
-                    field_mappings = [synth_utils.align_table_schema(sym_data[k].values, output) for k, output in enumerate(outputs)]
+                        #print(field_mappings)
 
-                    #print(field_mappings)
+                        if config["vis_backend"] == "vegalite":
+                            vis_design = VisDesign(data=outputs, chart=copy.deepcopy(chart))
+                            vis_design.update_field_names(field_mappings)
+                            result = ([p.stmt_string() for p in progs], vis_design)
+                        else:
+                            vis_design = MatplotlibChart(outputs,copy.deepcopy(chart))
+                            result = ([p.stmt_string() for p in progs], vis_design.to_string_spec(field_mappings))
+                    yield result
 
-                    if config["vis_backend"] == "vegalite":
-                        vis_design = VisDesign(data=outputs, chart=copy.deepcopy(chart))
-                        vis_design.update_field_names(field_mappings)
-                        candidates.append(([p.stmt_string() for p in progs], vis_design))
-                    else:
-                        vis_design = MatplotlibChart(outputs,copy.deepcopy(chart))
-                        candidates.append(([p.stmt_string() for p in progs], vis_design.to_string_spec(field_mappings)))
 
-            #if len(candidates) > 0: break
+    @staticmethod
+    def ranked_combinations(sizes, limit=None):
+        """lazily enumerate combinations (i_1, ..., i_n) with 0 <= i_k < sizes[k], i.e., choices of one 
+            candidate per layer, in the increasing order of i_1 + ... + i_n (the sum of the ranks of chosen candidates), 
+            combinations of the same rank are in lexicographical order, at most limit combinations are generated"""
+        if len(sizes) == 0 or any([n == 0 for n in sizes]):
+            return
+        start = tuple([0 for _ in sizes])
+        frontier, visited = [(0, start)], set([start])
+        num_generated = 0
+        while len(frontier) > 0 and (limit is None or num_generated < limit):
+            rank, choices = heapq.heappop(frontier)
+            yield choices
+            num_generated += 1
+            for k in range(len(choices)):
+                if choices[k] + 1 < sizes[k]:
+                    successor = choices[:k] + (choices[k] + 1,) + choices[k + 1:]
+                    if successor not in visited:
+                        visited.add(successor)
+                        heapq.heappush(frontier, (rank + 1, successor))
+
+    @staticmethod
+    def synthesize_layers(synthesizers, inputs, sym_data, config, deadline):
+        """synthesize table programs for all layers of a chart at the same time 
+            (synthesizers[i] searches programs that produce sym_data[i]), all searches stop at the deadline, 
+            returns the list of candidate solutions (see table.synthesizer.Solution) of each layer.
+            If num_workers > 1, sketches of all layers are submitted to the worker pool of the synthesizers 
+            before any result is collected, so that layers are explored by worker processes in parallel.
+            Otherwise layers are searched in threads of this process: the GIL serializes their searches, 
+            threads only interleave them so that layers share the time budget and the evaluation cache."""
+        if config["num_workers"] > 1:
+            pool = synthesizers[0].worker_pool
+            searches, results = [], []
+            # collect_solutions releases the slot of a search (even if it fails), other searches are stopped here
+            num_collecting = 0
+            try:
+                for synthesizer, d in zip(synthesizers, sym_data):
+                    searches.append(synthesizer.submit_enumerative_synthesis(inputs, d.instantiate(), 
+                                        config["max_prog_size"], deadline, config["solution_limit"], pool))
+                for synthesizer, search in zip(synthesizers, searches):
+                    num_collecting += 1
+                    results.append(synthesizer.collect_solutions(search, deadline, config["solution_limit"], pool))
+            finally:
+                for slot, futures in searches[num_collecting:]:
+                    pool.stop_search(slot)
+                    for future in futures:
+                        future.cancel()
+            return results
+
+        # profilers record stages of one thread, layer searches are recorded separately and merged
+        active_profiler = get_active_profiler()
+
+        def synthesize_layer(synthesizer, d):
+            layer_profiler = Profiler() if active_profiler is not None else None
+            with activate_profiler(layer_profiler):
+                solutions = synthesizer.enumerative_synthesis(
+                            inputs, d.instantiate(), 
+                            max_prog_size=config["max_prog_size"], 
+                            time_limit_sec=deadline.remaining(),
+                            solution_limit=config["solution_limit"],
+                            return_solutions=True)
+            return solutions, layer_profiler
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(sym_data)) as executor:
+            futures = [executor.submit(synthesize_layer, s, d) for s, d in zip(synthesizers, sym_data)]
+            results = [future.result() for future in futures]
+
+        for _, layer_profiler in results:
+            if layer_profiler is not None:
+                active_profiler.merge(layer_profiler.report())
+        return [solutions for solutions, _ in results]
+
+
+def _eval_trace_multiset(vis_design):
+    """evaluate the visual trace of a vis design, returns the multiset of its elements 
+        (used by group_results, possibly in a worker process)"""
+    return visual_trace.trace_multiset(vis_design.eval())
+
+
+class SynthesisSession(object):
+    """An incremental synthesis session for traces that grow one visual element at a time.
+        The session keeps the candidates found so far and the evaluated sub-program tables,
+        when new elements arrive, previous candidates are filtered against the larger trace first 
+        and the search is only restarted if none of them survive.
+    """
+
+    def __init__(self, inputs, extra_consts=[], config={}):
+        self.inputs = inputs
+        self.extra_consts = extra_consts
+        self.config = FalxInterface.update_config(config)
+        self.raw_trace = []
+        self.candidates = []
+        self.cache = eval_cache.EvalCache()
+
+    def add_elements(self, raw_elements, group_results=False):
+        """add visual elements (in the raw trace format) to the trace and update the candidates"""
+        self.raw_trace = self.raw_trace + raw_elements
+        example_trace = visual_trace.load_trace(self.raw_trace)
+
+        # only vis designs can be evaluated to traces (matplotlib candidates are string specs)
+        survivors = [(tbl_prog, vis_design) for tbl_prog, vis_design in self.candidates 
+                        if isinstance(vis_design, (VisDesign,)) 
+                            and visual_trace.trace_contain(example_trace, vis_design.eval())]
+
+        if len(survivors) > 0:
+            self.candidates = survivors
+        else:
+            self.candidates = list(FalxInterface.synthesize_iter(self.inputs, self.raw_trace, self.extra_consts, 
+                                    self.config, cache=self.cache))
 
         if group_results:
-            return FalxInterface.group_results(candidates)
+            return FalxInterface.group_results(self.candidates, self.config["num_workers"])
 
-        return candidates
+        return self.candidates
 
 if __name__ == '__main__':
 
@@ -1,15 +1,22 @@
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 
 from falx.table.language import *
-from falx.utils.synth_utils import remove_duplicate_columns, check_table_inclusion
+from falx.utils.synth_utils import (remove_duplicate_columns, check_table_inclusion, table_fingerprint, 
+	PremiseIndex)
+from falx.utils.deadline import check_deadline
 
-def backward_eval(node, out_df, is_outer_most=True):
+def backward_eval(node, out_df, is_outer_most=True, deadline=None, memo=None):
 	"""Given an ast node, and the output dataframe, 
 		find all possible premise chains branching out from the current dataframe
 	Args:
 		node: an ast node (generated from to_dict() method from operators in table.language)
 		out_df: the output data_frame that should be included by the given input
 		is_outer_most: whether the current node is the outermost level node
+		deadline: an optional Deadline, DeadlineExceeded is raised once it has passed
+		memo: an optional PremiseMemo, used to reuse premises computed for other sketches
 	Returns:
 		a list of premise chains, prepsenting all possible premises that could lead to the current requirement
 		each promise is in the form
@@ -22,13 +29,29 @@ def backward_eval(node, out_df, is_outer_most=True):
 	# we require that the output of the current node includes out_df (path is empty because we need no routing)
 	current_premise = (out_df, [])
 
+	check_deadline(deadline)
+
+	# premises only depend on the operators (not on their arguments), 
+	# so sketches sharing the same inner operators share the chains
+	key = ("chains", tuple(operator_chain(node)), is_outer_most)
+	if memo is not None:
+		cached = memo.get(key, out_df)
+		if cached is not None:
+			return cached
+
 	all_premesis_chains = []
 	if node["op"] != "table_ref":
 		# evaluate all possible premise the direct child node
-		inp_df_list = backward_eval_one_step(node["op"], out_df, is_outer_most)
+		if memo is not None:
+			inp_df_list = memo.get(("one_step", node["op"], is_outer_most), out_df)
+			if inp_df_list is None:
+				inp_df_list = backward_eval_one_step(node["op"], out_df, is_outer_most, deadline)
+				memo.put(("one_step", node["op"], is_outer_most), out_df, inp_df_list)
+		else:
+			inp_df_list = backward_eval_one_step(node["op"], out_df, is_outer_most, deadline)
 		for inp_df in inp_df_list:
 			# recursively calculate all premises from children
-			all_premesis_chains_from_child = backward_eval(node["children"][0], inp_df, False)
+			all_premesis_chains_from_child = backward_eval(node["children"][0], inp_df, False, deadline, memo)
 			for premise_chain in all_premesis_chains_from_child:
 				# also include the premise from the current node 
 				# so that we get all premise chains starting from the current node
@@ -37,19 +60,148 @@ def backward_eval(node, out_df, is_outer_most=True):
 				for premise in premise_chain:
 					combined_with_current += [(premise[0], [0] + premise[1])]
 				all_premesis_chains.append(combined_with_current)
+		all_premesis_chains = prune_subsumed_premises(all_premesis_chains, deadline, 
+													  memo.indexes if memo is not None else None)
 	else:
 		# no children from the node
 		all_premesis_chains.append([current_premise])
-	
+
+	if memo is not None:
+		memo.put(key, out_df, all_premesis_chains)
 	return all_premesis_chains
 
 
-def backward_eval_one_step(op, out_df, is_outer_most=False):
+def operator_chain(node):
+	"""operators from the node to the table it reads"""
+	ops = [node["op"]]
+	while node["op"] != "table_ref":
+		node = node["children"][0]
+		ops.append(node["op"])
+	return ops
+
+
+def premise_included(df1, df2, indexes):
+	"""check if any table including the premise df2 also includes the premise df1 (see check_table_inclusion), 
+		indexes memoizes compiled premises (see premise_index)"""
+	index1, index2 = premise_index(df1, indexes), premise_index(df2, indexes)
+	if index1.num_rows == 0:
+		return True
+	if index2.num_rows == 0:
+		return False
+	return index1.included_by(index2.value_sets)
+
+
+def premise_index(df, indexes):
+	"""the PremiseIndex of a premise, memoized in the dict indexes by the identity of the premise"""
+	entry = indexes.get(id(df))
+	# the reference to df is kept so that the id is not reused by another object
+	if entry is None or entry[0] is not df:
+		entry = (df, PremiseIndex(df))
+		indexes[id(df)] = entry
+	return entry[1]
+
+
+def prune_subsumed_premises(chains, deadline=None, indexes=None):
+	"""A program is only checked against premises at the path of its subquery (it passes if it includes any of them),
+		so a premise is redundant if another premise at the same path is included by it (which is weaker).
+		Redundant premises are replaced by the weaker premise in their chains, and duplicated chains are dropped.
+		(indexes optionally memoizes compiled premises, see premise_index)"""
+	if indexes is None:
+		indexes = {}
+	replacement = {}
+	paths = []
+	for chain in chains:
+		for _, path in chain:
+			if path not in paths:
+				paths.append(path)
+
+	for path in paths:
+		premises = list({id(pm): pm for chain in chains for pm, p in chain if p == path}.values())
+		kept = []
+		for df in premises:
+			check_deadline(deadline)
+			weaker = [k for k in kept if premise_included(k, df, indexes)]
+			if len(weaker) > 0:
+				replacement[id(df)] = weaker[0]
+				continue
+			stronger = [k for k in kept if premise_included(df, k, indexes)]
+			for k in stronger:
+				replacement[id(k)] = df
+			kept = [k for k in kept if all([k is not x for x in stronger])] + [df]
+
+	def resolve(df):
+		while id(df) in replacement:
+			df = replacement[id(df)]
+		return df
+
+	pruned_chains = {}
+	for chain in chains:
+		chain = [(resolve(pm), path) for pm, path in chain]
+		pruned_chains.setdefault(tuple([id(pm) for pm, _ in chain]), chain)
+	return list(pruned_chains.values())
+
+
+class PremiseMemo(object):
+	"""A memo of backward evaluation results, keyed by the operators, the fingerprint of the output requirement
+		and whether the operator is the outermost one. Equal fingerprints are confirmed by comparing the tables.
+		Memoized premises are shared between sketches, so they should never be modified in place.
+	"""
+
+	# number of output requirements remembered
+	MAX_ENTRIES = 4096
+
+	def __init__(self):
+		self._entries = OrderedDict()
+		self._fingerprints = {}
+		self._lock = threading.Lock()
+		# compiled premises (see premise_index)
+		self.indexes = {}
+
+	def fingerprint(self, df):
+		"""the fingerprint of a table, memoized by its identity (memoized premises are passed around as they are)"""
+		with self._lock:
+			entry = self._fingerprints.get(id(df))
+			# the reference to df is kept so that the id is not reused by another object
+			if entry is not None and entry[0] is df:
+				return entry[1]
+		fp = table_fingerprint(df)
+		with self._lock:
+			if len(self._fingerprints) >= PremiseMemo.MAX_ENTRIES:
+				self._fingerprints.clear()
+			self._fingerprints[id(df)] = (df, fp)
+		return fp
+
+	def premise_index(self, df):
+		"""the PremiseIndex of a premise, used for checking candidates against the premise"""
+		return premise_index(df, self.indexes)
+
+	def get(self, key, out_df):
+		key = key + (self.fingerprint(out_df),)
+		with self._lock:
+			for df, result in self._entries.get(key, []):
+				if df is out_df or (df.equals(out_df) and list(df.columns) == list(out_df.columns)):
+					self._entries.move_to_end(key)
+					return result
+		return None
+
+	def put(self, key, out_df, result):
+		key = key + (self.fingerprint(out_df),)
+		with self._lock:
+			self._entries.setdefault(key, []).append((out_df, result))
+			self._entries.move_to_end(key)
+			if len(self._entries) > PremiseMemo.MAX_ENTRIES:
+				self._entries.popitem(last=False)
+			if len(self.indexes) > PremiseMemo.MAX_ENTRIES:
+				self.indexes.clear()
+
+
+def backward_eval_one_step(op, out_df, is_outer_most=False, deadline=None):
 	"""backwardly evaluate an operator to infer property of the input
 		Given the operator and the output dataframe, 
 	Args:
 		op: the operator
 		out_df: the output data_frame requirement
+		deadline: an optional Deadline, DeadlineExceeded is raised once it has passed
 	Retursn:
 		all requirements for child nodes
 	"""
@@ -72,6 +224,7 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 
 		# if the united column is in the output
 		for i, c in enumerate(out_df.columns):
+			check_deadline(deadline)
 			if schema[i] != "string":
 				continue
 			col_vals = out_df[c].to_list()
@@ -79,7 +232,7 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 			if all(["_" in v for v in col_vals]):
 				#out_df[[x for x in out_df.columns if x != c]]
 				if not out_df.empty:
-					t = Separate(Table(0), i).eval([out_df])
+					t = Separate(Table(0), i).eval([out_df], deadline)
 					candidates += [t]
 				else:
 					candidates += [out_df]
@@ -100,6 +253,7 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 
 		# if only one of the separated columns is in the output
 		for i, sep_col in enumerate(cols):
+			check_deadline(deadline)
 			if schema[i] != "string":
 				continue
 			t = out_df[[c for c in cols if c != sep_col]]
@@ -107,15 +261,16 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 
 		# if both of the separated columns are in the output
 		for sep_col_indexes in itertools.combinations(range(len(cols)), 2):
+			check_deadline(deadline)
 			if not all([schema[i] == "string" for i in sep_col_indexes]):
 				continue
 			sep_cols = [cols[i] for i in sep_col_indexes]
 
 			for sep in ["-", "_", " "]:
-				t = Unite(Table(0), sep_col_indexes[0], sep_col_indexes[1], sep).eval([out_df])
+				t = Unite(Table(0), sep_col_indexes[0], sep_col_indexes[1], sep).eval([out_df], deadline)
 				candidates.append(t)
 			for sep in ["-", "_", " "]:
-				t = Unite(Table(0), sep_col_indexes[1], sep_col_indexes[0], sep).eval([out_df])
+				t = Unite(Table(0), sep_col_indexes[1], sep_col_indexes[0], sep).eval([out_df], deadline)
 				candidates.append(t)
 
 		return candidates
@@ -123,14 +278,17 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 	if op == "spread":
 		candidates = []
 
+		# the melted value column gets a fresh name, since pandas rejects names that clash with existing columns
+
 		# case 1: the id column is gone
 		if len(set(schema)) == 1:
-			t = pd.melt(out_df, id_vars=[], value_vars=cols, var_name='varNameColumn')
+			t = pd.melt(out_df, id_vars=[], value_vars=cols, var_name='varNameColumn', value_name=get_fresh_col(list(cols))[0])
 			t = t[[c for c in t.columns if c != "varNameColumn"]]
 			candidates += [t]
 
 		# case 2: the id column is there, enumerate all possible id columns
 		for i, id_col in enumerate(cols):
+			check_deadline(deadline)
 
 			if len(set([ty for k, ty in enumerate(schema) if k != i])) > 1:
 				# the value columns have mixed datatype
@@ -138,12 +296,13 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 
 			t = pd.melt(out_df, id_vars=[id_col], 
 						value_vars=[c for c in cols if c != id_col],
-						var_name='varNameColumn')
+						var_name='varNameColumn', value_name=get_fresh_col(list(cols))[0])
 			t = t[[c for c in t.columns if c != "varNameColumn"]]
 			candidates += [t]
 
 		# case 3: id column is not just one
 		for id_col_indexes in itertools.combinations(range(len(cols)), 2):
+			check_deadline(deadline)
 			 
 			if len(set([ty for k, ty in enumerate(schema) if k not in id_col_indexes])) > 1:
 				# the value columns have mixed datatype
@@ -153,7 +312,7 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 
 			t = pd.melt(out_df, id_vars=id_cols, 
 						value_vars=[c for c in cols if c not in id_cols],
-						var_name='varNameColumn')
+						var_name='varNameColumn', value_name=get_fresh_col(list(cols))[0])
 			t = t[[c for c in t.columns if c != "varNameColumn"]]
 			candidates += [t]
 
@@ -168,6 +327,7 @@ def backward_eval_one_step(op, out_df, is_outer_most=False):
 
 		# if both of the separated columns are in the output
 		for key_val in itertools.combinations(cols, 2):
+			check_deadline(deadline)
 			t = out_df[[c for c in cols if c not in key_val]]
 			t = t.drop_duplicates()
 			candidates += [t]
@@ -1,7 +1,30 @@
+import math
 from pprint import pprint
 from falx.table.language import HOLE
 
 
+def get_op_list(ast):
+    """list operators in the ast (from the outermost to the innermost one)"""
+    return [ast["op"]] + [v for c in ast["children"] if c["type"] == "node" for v in get_op_list(c)]
+
+
+def count_holes(ast):
+    """count the number of holes in the ast"""
+    return sum([count_holes(c) if c["type"] == "node" else int(c["value"] == HOLE) for c in ast["children"]])
+
+
+def max_hole_depth(ast):
+    """the length of the longest path from the root to a hole (0 if the ast contains no hole)"""
+    depths = []
+    for c in ast["children"]:
+        if c["type"] == "node":
+            if count_holes(c) > 0:
+                depths.append(max_hole_depth(c) + 1)
+        elif c["value"] == HOLE:
+            depths.append(1)
+    return max(depths + [0])
+
+
 def disable_sketch(p, new_vals, has_sep):
     """check if the program sketch is a bad sketch, 
             we will prevent bad sketch directly 
@@ -14,10 +37,6 @@ def disable_sketch(p, new_vals, has_sep):
         True if the sketch should be disabled
         False (we'll keep the sketch)
     """
-
-    def get_op_list(_ast):
-        return [_ast["op"]] + [v for c in _ast["children"] if c["type"] == "node" for v in get_op_list(c)]
-
     ast = p.to_dict()
     op_list = get_op_list(ast)
 
@@ -55,4 +74,54 @@ def disable_sketch(p, new_vals, has_sep):
     # No repetitive component except for separate.
     if contains_repetition(ast, except_list=["separate"]): return True
 
-    return False
\ No newline at end of file
+    return False
+
+
+def program_size_cost(ast, inputs, premise_chains, table):
+    """the cost of a (partial) program is its number of operators and remaining holes,
+        i.e., smaller and more concrete programs are explored first
+    Args:
+        ast: the (partial) program in ast form
+        inputs: input tables
+        premise_chains: premise chains of the sketch the program is instantiated from
+        table: the output of the innermost concrete sub-program (None for sketches)
+    Returns:
+        a cost, programs with lower cost are explored first
+    """
+    return len(get_op_list(ast)) + 0.5 * count_holes(ast)
+
+
+def estimated_cost(ast, inputs, premise_chains, table):
+    """the program size cost, plus the estimated size of the remaining search space 
+        (each hole ranges over roughly the columns of the innermost concrete table),
+        plus how selective premises are on that table (a table much larger than 
+        its premises is less likely to lead to the output)
+    """
+    num_holes = count_holes(ast)
+    if num_holes > 0 and len(premise_chains) == 0:
+        # no premise can be satisfied: instantiations of the sketch will all be pruned
+        return float("inf")
+
+    cost = program_size_cost(ast, inputs, premise_chains, table)
+
+    if table is not None:
+        num_cols = len(table.columns)
+    else:
+        num_cols = max([len(t[0]) for t in inputs if len(t) > 0] + [1])
+    cost += num_holes * math.log(num_cols + 1)
+
+    if table is not None and table.size > 0:
+        # holes are instantiated from the innermost level, so the table is the output of the sub-program 
+        # right below the deepest remaining hole, which is checked against premises at that level
+        level = max_hole_depth(ast)
+        premise_size = max([pm[0].size for chain in premise_chains for pm in chain if len(pm[1]) == level] + [1])
+        cost += max(0, math.log(table.size / premise_size))
+
+    return cost
+
+
+# cost models that can be selected by the "cost_model" option of the synthesizer config
+cost_models = {
+    "size": program_size_cost,
+    "estimated": estimated_cost,
+}
@@ -0,0 +1,137 @@
+import threading
+import contextlib
+import hashlib
+import json
+from collections import OrderedDict
+
+import pandas as pd
+
+from falx.utils.synth_utils import table_fingerprint
+
+# default upper bound of the memory used by cached tables
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+# the cache used by Node.cached_eval in the current thread (None means caching is disabled)
+_state = threading.local()
+
+
+def get_active_cache():
+	"""return the cache that is active in the current thread (or None)"""
+	return getattr(_state, "cache", None)
+
+
+@contextlib.contextmanager
+def activate(cache):
+	"""make the cache active for evaluations in the current thread within the context"""
+	previous = get_active_cache()
+	_state.cache = cache
+	try:
+		yield cache
+	finally:
+		_state.cache = previous
+
+
+def fingerprint_inputs(inputs):
+	"""compute a content fingerprint of the inputs (a list/dict of record lists or dataframes)"""
+	h = hashlib.sha1()
+	items = inputs.items() if isinstance(inputs, (dict,)) else enumerate(inputs)
+	for k, inp in items:
+		h.update(repr(k).encode())
+		if isinstance(inp, (pd.DataFrame,)):
+			h.update(table_fingerprint(inp).encode())
+		else:
+			h.update(json.dumps(inp, sort_keys=True, default=str).encode())
+	return h.hexdigest()
+
+
+class EvalCache(object):
+	"""A content-addressed cache of sub-program results.
+		Entries are keyed by the canonical dict form of the sub-program and a fingerprint of the inputs,
+		and are evicted in LRU order once the total size of cached tables exceeds max_bytes.
+		Cached tables are shared between callers, so they should never be modified in place.
+	"""
+
+	# number of input fingerprints remembered (fingerprints are memoized by the identity of inputs)
+	MAX_FINGERPRINTS = 64
+
+	# number of inferred schemas remembered (schemas are small, so they are bounded by count)
+	MAX_SCHEMAS = 100000
+
+	def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+		self.max_bytes = max_bytes
+		self.total_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._fingerprints = {}
+		self._schemas = OrderedDict()
+		self._lock = threading.RLock()
+
+	def input_fingerprint(self, inputs):
+		with self._lock:
+			entry = self._fingerprints.get(id(inputs))
+			# the reference to inputs is kept so that the id is not reused by another object
+			if entry is not None and entry[0] is inputs:
+				return entry[1]
+		fp = fingerprint_inputs(inputs)
+		with self._lock:
+			if len(self._fingerprints) >= EvalCache.MAX_FINGERPRINTS:
+				self._fingerprints.clear()
+			self._fingerprints[id(inputs)] = (inputs, fp)
+		return fp
+
+	def make_key(self, node, inputs):
+		prog_key = json.dumps(node.to_dict(), sort_keys=True, default=str)
+		return (prog_key, self.input_fingerprint(inputs))
+
+	def get(self, key):
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return self._entries[key][0]
+			self.misses += 1
+			return None
+
+	def put(self, key, df):
+		if isinstance(df, (pd.DataFrame,)):
+			size = int(df.memory_usage(index=True, deep=True).sum())
+		else:
+			# other table backends (see micro_table) estimate their own size
+			size = df.estimated_bytes()
+		if size > self.max_bytes:
+			# never cache a table that alone exceeds the budget
+			return
+		with self._lock:
+			if key in self._entries:
+				self.total_bytes -= self._entries.pop(key)[1]
+			self._entries[key] = (df, size)
+			self.total_bytes += size
+			while self.total_bytes > self.max_bytes:
+				_, (_, evicted_size) = self._entries.popitem(last=False)
+				self.total_bytes -= evicted_size
+
+	def get_schema(self, key):
+		"""get the inferred output schema (see Node.infer_output_info) of a sub-program"""
+		with self._lock:
+			if key in self._schemas:
+				self._schemas.move_to_end(key)
+				return self._schemas[key]
+			return None
+
+	def put_schema(self, key, schema):
+		with self._lock:
+			self._schemas[key] = schema
+			self._schemas.move_to_end(key)
+			if len(self._schemas) > EvalCache.MAX_SCHEMAS:
+				self._schemas.popitem(last=False)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._schemas.clear()
+			self._fingerprints.clear()
+			self.total_bytes = 0
+
+	def __len__(self):
+		return len(self._entries)
@@ -0,0 +1,163 @@
+import copy
+
+import pandas as pd
+
+from falx.table.language import Table, get_fresh_col
+from falx.utils.deadline import check_deadline, DeadlineExceeded
+
+
+class ColumnFrame(object):
+	"""An ordered collection of named columns (pandas Series sharing one index).
+		Columns are referenced instead of copied: operators that add or drop columns only
+		update the column list, and a DataFrame is only built when it is needed.
+	"""
+
+	__slots__ = ["names", "columns", "columns_name", "source"]
+
+	def __init__(self, names, columns, columns_name=None, source=None):
+		self.names = names
+		self.columns = columns
+		# the name of the column index (e.g., the key column of spread)
+		self.columns_name = columns_name
+		# the DataFrame the frame is read from (if it has not been changed since)
+		self.source = source
+
+	@staticmethod
+	def from_df(df):
+		return ColumnFrame(list(df.columns), {c: df[c] for c in df.columns}, df.columns.name, source=df)
+
+	def to_df(self):
+		if self.source is not None:
+			return self.source
+		df = pd.concat([self.columns[c] for c in self.names], axis=1)
+		df.columns.name = self.columns_name
+		return df
+
+	def replace(self, names, new_columns={}):
+		"""a frame with the given columns, new (derived) columns are added by reference"""
+		columns = dict(self.columns)
+		for name, col in new_columns.items():
+			col.name = name
+			columns[name] = col
+		return ColumnFrame(names, {c: columns[c] for c in names}, self.columns_name)
+
+
+class ExecutionPlan(object):
+	"""A concrete program compiled into a sequence of steps over column frames (see compile_program).
+		Column operators (select, unite, separate, cumsum, mutate) are fused: they share column buffers
+		instead of copying the table, other operators are run on a table built from the frame.
+	"""
+
+	def __init__(self, data_id, steps):
+		self.data_id = data_id
+		self.steps = steps
+
+	def execute(self, inputs, deadline=None):
+		"""run the plan on the inputs, returns the same DataFrame as evaluating the program"""
+		check_deadline(deadline)
+		inp = inputs[self.data_id]
+		df = pd.DataFrame.from_dict(inp) if isinstance(inp, (list,)) else inp
+		if df.columns.duplicated().any():
+			# columns are referenced by name in frames
+			return self.steps_as_program().eval([df], deadline)
+
+		frame = ColumnFrame.from_df(df)
+		for step in self.steps:
+			check_deadline(deadline)
+			frame = step(frame, deadline)
+		return frame.to_df()
+
+	def steps_as_program(self):
+		q = Table(0)
+		for step in self.steps:
+			q = step.with_input(q)
+		return q
+
+
+class PlanStep(object):
+	"""a step of an execution plan, created from an operator node of the program"""
+
+	def __init__(self, node):
+		self.node = node
+
+	def with_input(self, q):
+		"""the operator of the step applied to the program q"""
+		node = copy.copy(self.node)
+		node.q = q
+		return node
+
+	def __call__(self, frame, deadline):
+		handler = COLUMN_STEPS.get(type(self.node).__name__)
+		if handler is not None:
+			result = handler(self.node, frame)
+			if result is not None:
+				return result
+		# operators that reshape the table are evaluated on a DataFrame built from the frame
+		df = self.with_input(Table(0)).eval([frame.to_df()], deadline)
+		return ColumnFrame.from_df(df)
+
+
+def _select_step(node, frame):
+	return frame.replace([frame.names[i] for i in node.cols])
+
+
+def _unite_step(node, frame):
+	new_col = get_fresh_col(frame.names)[0]
+	c1, c2 = frame.names[node.col1], frame.names[node.col2]
+	united = frame.columns[c1] + node.sep + frame.columns[c2]
+	return frame.replace([c for c in frame.names if c not in [c1, c2]] + [new_col], {new_col: united})
+
+
+def _separate_step(node, frame):
+	col = frame.names[node.col_index]
+	splitted = frame.columns[col].str.split(r"\s|_|-", n=1, expand=True)
+	new_col_names = get_fresh_col(frame.names, n=2)
+	return frame.replace([c for c in frame.names if c != col] + new_col_names,
+						 {new_col_names[0]: splitted[0], new_col_names[1]: splitted[1]})
+
+
+def _cumsum_step(node, frame):
+	cumsum = frame.columns[frame.names[node.target]].cumsum()
+	names = frame.names if "cumsum" in frame.names else frame.names + ["cumsum"]
+	return frame.replace(names, {"cumsum": cumsum})
+
+
+def _mutate_step(node, frame):
+	if node.op not in ["+", "-"]:
+		return None
+	new_col = get_fresh_col(frame.names)[0]
+	c1, c2 = frame.columns[frame.names[node.col1]], frame.columns[frame.names[node.col2]]
+	mutated = (c1 + c2) if node.op == "+" else (c1 - c2)
+	return frame.replace(frame.names + [new_col], {new_col: mutated})
+
+
+# steps that only add or drop columns, indexed by the operator class
+# (a step returns None if it cannot handle the arguments)
+COLUMN_STEPS = {
+	"Select": _select_step,
+	"Unite": _unite_step,
+	"Separate": _separate_step,
+	"CumSum": _cumsum_step,
+	"Mutate": _mutate_step,
+}
+
+
+def compile_program(p):
+	"""compile a concrete program (a Node without holes) into an ExecutionPlan"""
+	assert not p.is_abstract(), "[compile_program] only concrete programs can be compiled."
+	steps = []
+	while not isinstance(p, (Table,)):
+		steps.append(PlanStep(p))
+		p = p.q
+	return ExecutionPlan(p.data_id, list(reversed(steps)))
+
+
+def run_program(p, inputs, deadline=None):
+	"""evaluate a concrete program with its execution plan (e.g., to re-run a chosen program on full tables),
+		the program is evaluated by Node.eval if its plan cannot run it"""
+	try:
+		return compile_program(p).execute(inputs, deadline)
+	except DeadlineExceeded:
+		raise
+	except Exception:
+		return p.eval(inputs, deadline)
@@ -4,6 +4,11 @@ from abc import ABC, abstractmethod
 import copy
 import itertools
 
+from falx.table import eval_cache
+from falx.table.table_shape import TableShape, ColumnShape, value_range, range_hull
+from falx.utils.deadline import DeadlineExceeded, check_deadline
+from falx.utils.profiler import profile
+
 
 # two special symbols used in the language
 HOLE = "_?_"
@@ -17,7 +22,7 @@ class Node(ABC):
 		super(AbstractExpression, self).__init__()
 
 	@abstractmethod
-	def eval(self, inputs):
+	def eval(self, inputs, deadline=None):
 		"""the inputs are dataframes,
 			it returns a pandas dataframe representation"""
 		pass
@@ -27,13 +32,66 @@ class Node(ABC):
 		pass
 
 	@abstractmethod
-	def infer_domain(self, arg_id, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		pass
 
 	@abstractmethod
 	def infer_output_info(self, inputs):
 		pass
 
+	def cached_eval(self, inputs, deadline=None):
+		"""evaluate the node, reusing the result of an identical sub-program 
+			if an evaluation cache is active (see falx.table.eval_cache)"""
+		cache = eval_cache.get_active_cache()
+		if cache is None:
+			with profile("eval", type(self).__name__):
+				return self.eval(inputs, deadline)
+		key = cache.make_key(self, inputs)
+		df = cache.get(key)
+		if df is None:
+			with profile("eval", type(self).__name__):
+				df = self.eval(inputs, deadline)
+			cache.put(key, df)
+		return df
+
+	def cached_output_info(self, inputs):
+		"""infer the output schema of the node, reusing the schema of an identical sub-program 
+			if an evaluation cache is active (see falx.table.eval_cache)"""
+		cache = eval_cache.get_active_cache()
+		if cache is None:
+			return self.infer_output_info(inputs)
+		key = cache.make_key(self, inputs)
+		schema = cache.get_schema(key)
+		if schema is None:
+			schema = self.infer_output_info(inputs)
+			if schema is None:
+				return None
+			cache.put_schema(key, list(schema))
+		return list(schema)
+
+	def infer_output_shape(self, inputs):
+		"""infer an abstraction of the output table (a table_shape.TableShape) without evaluating the program, 
+			returns None if the shape is unknown"""
+		return None
+
+	def cached_output_shape(self, inputs):
+		"""infer the output shape of a concrete node, reusing the shape of an identical sub-program 
+			if an evaluation cache is active (see falx.table.eval_cache)"""
+		if self.is_abstract():
+			return None
+		cache = eval_cache.get_active_cache()
+		if cache is None:
+			return self.infer_output_shape(inputs)
+		prog_key, inputs_key = cache.make_key(self, inputs)
+		key = ("shape:" + prog_key, inputs_key)
+		shape = cache.get_schema(key)
+		if shape is None:
+			shape = self.infer_output_shape(inputs)
+			if shape is None:
+				return None
+			cache.put_schema(key, shape)
+		return shape
+
 	@staticmethod
 	def load_from_dict(ast):
 		"""given a dictionary represented AST, load it in to a program form"""
@@ -114,7 +172,7 @@ class Table(Node):
 	def __init__(self, data_id):
 		self.data_id = data_id
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		assert False, "Table has no args to infer domain."
 
 	def infer_output_info(self, inputs):
@@ -127,7 +185,13 @@ class Table(Node):
 		schema = extract_table_schema(df)
 		return schema
 
-	def eval(self, inputs):
+	def infer_output_shape(self, inputs):
+		inp = inputs[self.data_id]
+		df = pd.DataFrame.from_dict(inp) if isinstance(inp, (list,)) else inp
+		return TableShape.from_df(df)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
 		inp = inputs[self.data_id]
 		if isinstance(inp, (list,)):
 			df = pd.DataFrame.from_dict(inp)
@@ -150,23 +214,31 @@ class Select(Node):
 		self.q = q
 		self.cols = cols
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		if arg_id == 1:
-			input_schema = self.q.infer_output_info(inputs)
+			input_schema = self.q.cached_output_info(inputs)
 			col_num = len(input_schema)
 			col_list_candidates = []
 			for size in range(1, col_num + 1):
+				check_deadline(deadline)
 				col_list_candidates += list(itertools.combinations(list(range(col_num)), size))
 			return col_list_candidates
 		else:
 			assert False, "[Select] No args to infer domain for id > 1."
 
 	def infer_output_info(self, inputs):
-		schema = self.q.infer_output_info(inputs)
+		schema = self.q.cached_output_info(inputs)
 		return [s for i, s in enumerate(schema) if i in self.cols]
 
-	def eval(self, inputs):
-		df = self.q.eval(inputs)
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None:
+			return None
+		return TableShape([shape.names[i] for i in self.cols], [shape.columns[i] for i in self.cols], shape.max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
+		df = self.q.cached_eval(inputs, deadline)
 		return df[[df.columns[i] for i in self.cols]]
 
 	def backward_eval(self, output):
@@ -189,8 +261,8 @@ class Unite(Node):
 		self.col2 = col2
 		self.sep = sep
 
-	def infer_domain(self, arg_id, inputs, config):
-		input_schema = self.q.infer_output_info(inputs)
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
+		input_schema = self.q.cached_output_info(inputs)
 		str_cols = [i for i, s in enumerate(input_schema) if s == "string"]
 		if arg_id == 1:
 			return str_cols
@@ -201,11 +273,21 @@ class Unite(Node):
 			assert False, "[Unite] No args to infer domain for id > 2."
 
 	def infer_output_info(self, inputs):
-		input_schema = self.q.infer_output_info(inputs)
+		input_schema = self.q.cached_output_info(inputs)
 		return [s for i,s in enumerate(input_schema) if i not in [self.col1, self.col2]] + ["string"]
 
-	def eval(self, inputs):
-		df = self.q.eval(inputs)
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None:
+			return None
+		c1, c2 = shape.names[self.col1], shape.names[self.col2]
+		keep = [i for i, c in enumerate(shape.names) if c not in [c1, c2]]
+		return TableShape([shape.names[i] for i in keep] + get_fresh_col(shape.names), 
+						  [shape.columns[i] for i in keep] + [ColumnShape()], shape.max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
+		df = self.q.cached_eval(inputs, deadline)
 		ret = df.copy()
 		new_col = get_fresh_col(list(ret.columns))[0]
 		c1, c2 = ret.columns[self.col1], ret.columns[self.col2]
@@ -236,9 +318,9 @@ class Filter(Node):
 		self.op = op
 		self.const = const
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		if arg_id == 1:
-			col_num = len(self.q.infer_output_info(inputs))
+			col_num = len(self.q.cached_output_info(inputs))
 			return list(range(col_num))
 		elif arg_id == 2:
 			return config["filer_op"]
@@ -248,10 +330,19 @@ class Filter(Node):
 			assert False, "[Filter] No args to infer domain for id > 3."
 
 	def infer_output_info(self, inputs):
-		return self.q.infer_output_info(inputs)
+		return self.q.cached_output_info(inputs)
 
-	def eval(self, inputs):
-		df = self.q.eval(inputs)
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None or "index" in shape.names:
+			return None
+		# the filtered table contains a subset of rows, and the index of the input is added as a column
+		return TableShape(["index"] + shape.names, [ColumnShape()] + [c.superset() for c in shape.columns], 
+						  shape.max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
+		df = self.q.cached_eval(inputs, deadline)
 		col = df.columns[self.col_index]
 		if self.op == "==":
 			return df[df[col] == self.const].reset_index()
@@ -277,19 +368,22 @@ class Separate(Node):
 		self.q = q
 		self.col_index = col_index
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		if arg_id == 1:
 			try:
-				df = self.q.eval(inputs)
+				df = self.q.cached_eval(inputs, deadline)
+			except DeadlineExceeded:
+				raise
 			except Exception as e:
 				print(f"[eval error in infer_domain] {e}")
 				return []
-			input_schema = self.q.infer_output_info(inputs)
+			input_schema = self.q.cached_output_info(inputs)
 			domain = []
 			#TODO: need to improve precisions of type inferene
 			# print(df)
 			# print(input_schema)
 			for i, s in enumerate(input_schema):
+				check_deadline(deadline)
 				if s != "string": 
 					continue
 				l = list(df[df.columns[i]])
@@ -306,11 +400,21 @@ class Separate(Node):
 			assert False, "[Separate] No args to infer domain for id > 1."
 
 	def infer_output_info(self, inputs):
-		input_schema = self.q.infer_output_info(inputs)
+		input_schema = self.q.cached_output_info(inputs)
 		return [s for i, s in enumerate(input_schema) if i != self.col_index] + ["string", "string"]
 
-	def eval(self, inputs):
-		df = self.q.eval(inputs)
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None:
+			return None
+		col = shape.names[self.col_index]
+		keep = [i for i, c in enumerate(shape.names) if c != col]
+		return TableShape([shape.names[i] for i in keep] + get_fresh_col(shape.names, n=2), 
+						  [shape.columns[i] for i in keep] + [ColumnShape(), ColumnShape()], shape.max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
+		df = self.q.cached_eval(inputs, deadline)
 
 		ret = df.copy()
 		col = ret.columns[self.col_index]
@@ -337,8 +441,8 @@ class Spread(Node):
 		self.key = key
 		self.val = val
 
-	def infer_domain(self, arg_id, inputs, config):
-		schema = self.q.infer_output_info(inputs)
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
+		schema = self.q.cached_output_info(inputs)
 		if arg_id == 1:
 			if self.q.is_abstract():
 				return list(range(len(schema)))
@@ -346,60 +450,61 @@ class Spread(Node):
 				# approximation: only get fields with more than one values
 				# for the purpose of avoiding empty fields
 				try:
-					df = self.q.eval(inputs)
+					df = self.q.cached_eval(inputs, deadline)
+				except DeadlineExceeded:
+					raise
 				except Exception as e:
 					print(f"[eval error in infer_domain] {e}")
 					return []
 				cols = []
 				for i, c in enumerate(df.columns):					
-					l = list(df[c])
-					vals_cnt = [l.count(x) for x in set(l)]
+					check_deadline(deadline)
+					vals_cnt = count_values(df[c])
 					# (1) all values should have the same cardinality
 					# (2) their cardinality should all be greater than 1
 					# (3) there should be at least two distrint value
-					if len(set(vals_cnt)) == 1 and vals_cnt[0] > 1 and vals_cnt[0] != len(l):
+					if len(set(vals_cnt)) == 1 and vals_cnt[0] > 1 and vals_cnt[0] != len(df):
 						cols.append(i)
 				return cols
 		if arg_id == 2:
 			if self.key != HOLE:
 				try:
-					df = self.q.eval(inputs)
+					df = self.q.cached_eval(inputs, deadline)
+				except DeadlineExceeded:
+					raise
 				except Exception as e:
 					print(f"[eval error in infer_domain] {e}")
 					return []
 
-				val_col_domain = []
-				for i, vcol in enumerate(df.columns):
-					if i == self.key:
-						continue
+				if df.isnull().values.any() or df.columns.duplicated().any():
+					# tuples containing NaN are compared by identity (and duplicate column names are ambiguous), 
+					# which codes cannot reproduce
+					return spread_value_domain_by_tuples(df, self.key, deadline)
 
-					# values in the key column
-					key_values = list(df[df.columns[self.key]])
-					key_cnt = [key_values.count(x) for x in set(key_values)]
-					
-					# values in the id column (columns outside of key or val)
-					id_cols = [c for k, c in enumerate(df.columns) if k != i and k != self.key]
-					id_value_tuples = [tuple(x) for x in df[id_cols].to_records(index=False)]
+				# values are replaced by their codes (#row x #column), the same value in a column has the same code
+				codes = factorize_table(df)
+				num_rows = len(df)
+				num_keys = int(codes[:, self.key].max()) + 1 if num_rows > 0 else 0
 
-					# restrict how many keys can be maximally generated from spread
-					if SPREAD_MAX_KEYSIZE != None and len(set(key_values)) > SPREAD_MAX_KEYSIZE:
+				# restrict how many keys can be maximally generated from spread
+				if SPREAD_MAX_KEYSIZE != None and num_keys > SPREAD_MAX_KEYSIZE:
+					return []
+
+				val_col_domain = []
+				for i in range(len(df.columns)):
+					check_deadline(deadline)
+					if i == self.key:
 						continue
 
-					# print("...>>>>>>>>")
-					# print(id_cols)
-					# print(key_values)
-					# print(set(key_values))
-					# print(key_cnt)
-					# print(set(id_value_tuples))
-					# print("{} {} {}".format(len(set(id_value_tuples)), key_cnt[0], len(set(key_values))))
+					# id columns (columns outside of key or val)
+					id_cols = [k for k in range(len(df.columns)) if k != i and k != self.key]
 
 					# only add the value column into the domain 
 					# if #cardinality of key column * #distinct values in id column matches the # of rows tables
-					if len(set(id_value_tuples)) *  len(set(key_values)) == len(key_values):
-						# if it contains duplicate entries, remove them
-						id_key_content = df[id_cols + [df.columns[self.key]]]
-						if not id_key_content.duplicated().any():
-							val_col_domain.append(i)
+					# (and id and key columns together contain no duplicate entries)
+					if (count_distinct_rows(codes[:, id_cols]) * num_keys == num_rows 
+						and count_distinct_rows(codes[:, id_cols + [self.key]]) == num_rows):
+						val_col_domain.append(i)
 
 				return val_col_domain #[i for i in range(len(schema)) if i != self.key]
 			else:
@@ -412,14 +517,41 @@ class Spread(Node):
 			return None
 		else:
 			try:
-				schema = extract_table_schema(self.eval(inputs))
+				schema = extract_table_schema(self.cached_eval(inputs))
 				return schema
 			except Exception as e:
 				#TODO: use this to indicate the domain would be empty
 				print(f"[eval error in infer_domain] {e}")
 				return []
 
-	def eval(self, inputs):
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None:
+			return None
+		key_col, val_col = shape.names[self.key], shape.names[self.val]
+		index_ids = [i for i, c in enumerate(shape.names) if c not in [key_col, val_col]]
+		key_shape = shape.columns[self.key]
+		if len(index_ids) == 0 or self.key == self.val or key_shape.has_null():
+			# new columns are only known if keys are known
+			return None
+		try:
+			keys = sorted(key_shape.values)
+		except TypeError:
+			return None
+
+		# rows are distinct index tuples (index columns keep their values unless they contain missing values)
+		max_rows = shape.max_rows
+		index_columns = [shape.columns[i] for i in index_ids]
+		if not any([c.has_null() for c in index_columns]):
+			max_rows = min(max_rows, int(np.prod([len(c.values) for c in index_columns])))
+		else:
+			index_columns = [c.superset() for c in index_columns]
+		value_shape = ColumnShape(None, shape.columns[self.val].value_range)
+		return TableShape([shape.names[i] for i in index_ids] + keys, 
+						  index_columns + [value_shape for _ in keys], max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
 		def multiindex_pivot(df, columns=None, values=None):
 			# a helper function for performing multi-index pivoting
 		    #https://github.com/pandas-dev/pandas/issues/23955
@@ -433,7 +565,7 @@ class Spread(Node):
 		    index = pd.MultiIndex.from_tuples(tuples_index, names=names)
 		    df.index = index
 		    return df
-		df = self.q.eval(inputs)
+		df = self.q.cached_eval(inputs, deadline)
 		key_col, val_col = df.columns[self.key], df.columns[self.val]
 		index_cols = [c for c in list(df.columns) if c not in [key_col, val_col]]
 		ret = df.set_index(index_cols)
@@ -456,10 +588,10 @@ class Gather(Node):
 		self.q = q
 		self.value_columns = value_columns
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 
 		if arg_id == 1:
-			input_schema = self.q.infer_output_info(inputs)
+			input_schema = self.q.cached_output_info(inputs)
 			col_num = len(input_schema)
 			col_list_candidates = []
 
@@ -470,6 +602,7 @@ class Gather(Node):
 
 			for size in range(2, max_val_list_size + 1):
 				for l in list(itertools.combinations(list(range(col_num)), size)):
+					check_deadline(deadline)
 					# only consider these fields together if they have the same type
 					if len(set([input_schema[i] for i in l])) == 1:
 						col_list_candidates.append(l)
@@ -487,6 +620,7 @@ class Gather(Node):
 			if max_key_list_size > 0:			
 				for size in range(1, max_key_list_size + 1):
 					for l in list(itertools.combinations(list(range(col_num)), size)):
+						check_deadline(deadline)
 						# only consider these fields together if they have the same type
 						if len(set([input_schema[i] for i in range(len(input_schema)) if i not in l])) == 1:
 							col_list_candidates.append([x for x in range(col_num) if x not in l])
@@ -496,11 +630,33 @@ class Gather(Node):
 			assert False, "[Gather] No args to infer domain for id > 1."
 
 	def infer_output_info(self, inputs):
-		input_schema = self.q.infer_output_info(inputs)
+		input_schema = self.q.cached_output_info(inputs)
 		return [s for i, s in enumerate(input_schema) if i not in self.value_columns] + ["string"] + ["unknown"]
 
-	def eval(self, inputs):
-		df = self.q.eval(inputs)
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None or "VALUE" in shape.names:
+			return None
+		value_vars = [shape.names[idx] for idx in self.value_columns]
+		key_ids = [i for i, c in enumerate(shape.names) if c not in value_vars]
+		if len(value_vars) == 0 or "KEY" in [shape.names[i] for i in key_ids]:
+			return None
+		value_columns = [shape.column(c) for c in value_vars]
+		# each value column contributes one row per input row
+		max_rows = shape.max_rows * len(value_vars)
+		if shape.max_rows == 0:
+			key_column, value_column = ColumnShape(frozenset()), ColumnShape(frozenset())
+		else:
+			value_sets = [c.values for c in value_columns]
+			key_column = ColumnShape(frozenset(value_vars), value_range(value_vars))
+			value_column = ColumnShape(frozenset().union(*value_sets) if None not in value_sets else None, 
+									   range_hull([c.value_range for c in value_columns]))
+		return TableShape([shape.names[i] for i in key_ids] + ["KEY", "VALUE"], 
+						  [shape.columns[i] for i in key_ids] + [key_column, value_column], max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
+		df = self.q.cached_eval(inputs, deadline)
 		value_vars = [df.columns[idx] for idx in self.value_columns]
 		key_vars = [c for c in df.columns if c not in value_vars]
 		return pd.melt(df, id_vars=key_vars, value_vars=value_vars, 
@@ -520,36 +676,25 @@ class GroupSummary(Node):
 		self.aggr_col = aggr_col
 		self.aggr_func = aggr_func
 
-	def infer_domain(self, arg_id, inputs, config):
-		schema = self.q.infer_output_info(inputs)
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
+		schema = self.q.cached_output_info(inputs)
 		if arg_id == 1:
 			# approximation: only get fields with more than one values
 			# for the purpose of avoiding empty fields
 			try:
-				df = self.q.eval(inputs)
+				df = self.q.cached_eval(inputs, deadline)
+			except DeadlineExceeded:
+				raise
 			except Exception as e:
 				print(f"[eval error in infer_domain] {e}")
 				return []
 
-			# use this list to store primitive table keys, 
-			# use them to elimiate column combinations that contain no duplicates
-			table_keys = []
-
-			col_num = len(schema)
-			col_list_candidates = []
-			for size in range(1, col_num + 1 - 1):
-				for gb_keys in itertools.combinations(list(range(col_num)), size):
-					if any([set(banned).issubset(set(gb_keys)) for banned in table_keys]):
-						# current key group is subsumbed by a table key, so all fields will be distinct
-						continue
-					gb_cols = df[[df.columns[k] for k in gb_keys]]
-					if not gb_cols.duplicated().any():
-						# a key group is valid for aggregation 
-						#   if there exists at least a key appear more than once
-						table_keys.append(gb_keys)
-						continue
-		
-					col_list_candidates += [gb_keys]
+			# a key group is valid for aggregation if there exists at least a key appear more than once,
+			# column groups containing a table key (a group without duplicates) are never valid
+			# groups have at most len(schema) - 1 keys (one column is aggregated), 
+			# callers can opt in to a smaller cap with config["group_max_key_list_size"]
+			max_key_list_size = min(len(schema) - 1, config.get("group_max_key_list_size", len(schema) - 1))
+			col_list_candidates = non_key_column_groups(df, max_size=max_key_list_size, deadline=deadline)
 			return col_list_candidates
 		elif arg_id == 2:
 			number_fields = [i for i,s in enumerate(schema) if s == "number"]
@@ -572,12 +717,44 @@ class GroupSummary(Node):
 			assert False, "[Gather] No args to infer domain for id > 1."
 
 	def infer_output_info(self, inputs):
-		input_schema = self.q.infer_output_info(inputs)
+		input_schema = self.q.cached_output_info(inputs)
 		aggr_type = input_schema[self.aggr_col] if self.aggr_func != "count" else "number"
 		return [s for i, s in enumerate(input_schema) if i in self.group_cols] + [aggr_type]
 
-	def eval(self, inputs):
-		df = self.q.eval(inputs)
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None:
+			return None
+		group_keys = [shape.names[idx] for idx in self.group_cols]
+		target = shape.names[self.aggr_col]
+		if target in group_keys:
+			return None
+
+		# there is one row per group, groups with missing keys are dropped
+		max_rows = shape.max_rows
+		key_columns = [shape.columns[idx] for idx in self.group_cols]
+		if not any([c.has_null() for c in key_columns]):
+			max_rows = min(max_rows, int(np.prod([len(c.values) for c in key_columns])))
+		else:
+			key_columns = [c.superset() for c in key_columns]
+
+		target_range = shape.columns[self.aggr_col].value_range
+		if self.aggr_func == "count":
+			aggr_range = (0, max(shape.max_rows, 1))
+		elif self.aggr_func == "mean":
+			aggr_range = target_range
+		elif self.aggr_func == "sum" and target_range is not None:
+			# a sum of up to #rows values (or 0 if all values are missing)
+			lo, hi = target_range
+			aggr_range = (min(0, lo, lo * shape.max_rows), max(0, hi, hi * shape.max_rows))
+		else:
+			aggr_range = None
+		return TableShape(group_keys + [f'{self.aggr_func}_{target}'], 
+						  key_columns + [ColumnShape(None, aggr_range)], max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
+		df = self.q.cached_eval(inputs, deadline)
 		group_keys = [df.columns[idx] for idx in self.group_cols]
 		target = df.columns[self.aggr_col]
 		res = df.groupby(group_keys).agg({target: self.aggr_func})
@@ -601,20 +778,35 @@ class CumSum(Node):
 		self.q = q
 		self.target = target
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		if arg_id == 1:
-			input_schema = self.q.infer_output_info(inputs)
+			input_schema = self.q.cached_output_info(inputs)
 			return [i for i, s in enumerate(input_schema) if s == "number"]
 		else:
 			assert False, "[CumSum] No args to infer domain for id > 1."
 
 	def infer_output_info(self, inputs):
-		input_schema = self.q.infer_output_info(inputs)
+		input_schema = self.q.cached_output_info(inputs)
 
 		return input_schema + ["number"]
 
-	def eval(self, inputs):
-		df = self.q.eval(inputs)
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None:
+			return None
+		target_range = shape.columns[self.target].value_range
+		cumsum_range = None
+		if target_range is not None:
+			# prefix sums of 1 to #rows values
+			lo, hi = target_range
+			cumsum_range = (min(lo, lo * shape.max_rows), max(hi, hi * shape.max_rows))
+		names = shape.names if "cumsum" in shape.names else shape.names + ["cumsum"]
+		columns = [ColumnShape(None, cumsum_range) if c == "cumsum" else shape.column(c) for c in names]
+		return TableShape(names, columns, shape.max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
+		df = self.q.cached_eval(inputs, deadline)
 		ret = df.copy()
 		#new_col = get_fresh_col(list(ret.columns))[0]
 		ret["cumsum"] = ret[ret.columns[self.target]].cumsum()
@@ -635,9 +827,9 @@ class Mutate(Node):
 		self.op = op
 		self.col2 = col2
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		if arg_id in [1, 3]:
-			input_schema = self.q.infer_output_info(inputs)
+			input_schema = self.q.cached_output_info(inputs)
 			number_fields = [i for i, s in enumerate(input_schema) if s == "number"]
 			if arg_id == 1:
 				return number_fields
@@ -655,12 +847,24 @@ class Mutate(Node):
 			assert False, "[Mutate] No args to infer domain for id > 3."
 
 	def infer_output_info(self, inputs):
-		input_schema = self.q.infer_output_info(inputs)
+		input_schema = self.q.cached_output_info(inputs)
 		return input_schema + ["number"]
 
-	def eval(self, inputs):
+	def infer_output_shape(self, inputs):
+		shape = self.q.cached_output_shape(inputs)
+		if shape is None or self.op not in ["+", "-"]:
+			return None
+		r1, r2 = shape.columns[self.col1].value_range, shape.columns[self.col2].value_range
+		new_range = None
+		if r1 is not None and r2 is not None:
+			new_range = (r1[0] + r2[0], r1[1] + r2[1]) if self.op == "+" else (r1[0] - r2[1], r1[1] - r2[0])
+		return TableShape(shape.names + get_fresh_col(shape.names), 
+						  shape.columns + [ColumnShape(None, new_range)], shape.max_rows)
+
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
 		assert (self.op in ["-", "+"])
-		df = self.q.eval(inputs)
+		df = self.q.cached_eval(inputs, deadline)
 		ret = df.copy()
 		new_col = get_fresh_col(list(ret.columns))[0]
 		c1, c2 = ret.columns[self.col1], ret.columns[self.col2]
@@ -693,9 +897,9 @@ class MutateCustom(Node):
 		self.op = op
 		self.const = const
 
-	def infer_domain(self, arg_id, inputs, config):
+	def infer_domain(self, arg_id, inputs, config, deadline=None):
 		if arg_id == 1:
-			input_schema = self.q.infer_output_info(inputs)
+			input_schema = self.q.cached_output_info(inputs)
 			return [i for i, s in enumerate(input_schema) if s == "number"]
 		elif arg_id == 2:
 			return config["mutate_op"]
@@ -705,12 +909,13 @@ class MutateCustom(Node):
 			assert False, "[MutateCustom] No args to infer domain for id > 3."
 
 	def infer_output_info(self, inputs):
-		input_schema = self.q.infer_output_info(inputs)
+		input_schema = self.q.cached_output_info(inputs)
 		return input_schema + ["number"]
 
-	def eval(self, inputs):
+	def eval(self, inputs, deadline=None):
+		check_deadline(deadline)
 		assert(op == "==")
-		df = self.q.eval(inputs)
+		df = self.q.cached_eval(inputs, deadline)
 		ret = df.copy()
 		new_col = get_fresh_col(list(ret.columns))[0]
 		c = ret.columns[self.col]
@@ -773,4 +978,97 @@ def extract_table_schema(df):
 			sys.exit(-1)
 
 	schema = [dtype_mapping(s) for s in df.infer_objects().dtypes]
-	return schema
\ No newline at end of file
+	return schema
+
+
+def count_values(col):
+	"""count occurrences of each distinct value in a column (in no particular order)"""
+	if col.isnull().values.any():
+		# NaN values are compared by identity in python sets, keep that semantics for columns with NaN
+		l = list(col)
+		return [l.count(x) for x in set(l)]
+	codes, _ = pd.factorize(col)
+	return np.bincount(codes).tolist()
+
+
+def factorize_table(df):
+	"""encode each column of a dataframe (without NaN) as integer codes, returns a #row x #column matrix"""
+	codes = np.empty((len(df), len(df.columns)), dtype=np.int64)
+	for i in range(len(df.columns)):
+		codes[:, i] = pd.factorize(df.iloc[:, i])[0]
+	return codes
+
+
+def count_distinct_rows(codes):
+	"""count distinct rows of a code matrix (a table without columns has one distinct row if it is not empty)"""
+	if codes.shape[1] == 0:
+		return min(codes.shape[0], 1)
+	return int((~pd.DataFrame(codes).duplicated()).sum())
+
+
+def spread_value_domain_by_tuples(df, key, deadline=None):
+	"""value columns that can be spread by the key column, comparing rows as python tuples"""
+	val_col_domain = []
+	for i, vcol in enumerate(df.columns):
+		check_deadline(deadline)
+		if i == key:
+			continue
+
+		# values in the key column
+		key_values = list(df[df.columns[key]])
+		
+		# values in the id column (columns outside of key or val)
+		id_cols = [c for k, c in enumerate(df.columns) if k != i and k != key]
+		id_value_tuples = [tuple(x) for x in df[id_cols].to_records(index=False)] if len(id_cols) > 0 else [() for _ in range(len(df))]
+
+		# restrict how many keys can be maximally generated from spread
+		if SPREAD_MAX_KEYSIZE != None and len(set(key_values)) > SPREAD_MAX_KEYSIZE:
+			continue
+
+		# only add the value column into the domain 
+		# if #cardinality of key column * #distinct values in id column matches the # of rows tables
+		if len(set(id_value_tuples)) *  len(set(key_values)) == len(key_values):
+			# if it contains duplicate entries, remove them
+			id_key_content = df[id_cols + [df.columns[key]]]
+			if not id_key_content.duplicated().any():
+				val_col_domain.append(i)
+
+	return val_col_domain
+
+
+def non_key_column_groups(df, max_size, deadline=None):
+	"""list column groups (tuples of column indexes, up to max_size columns) whose values contain duplicates,
+		ordered by size and then lexicographically (i.e., the order of itertools.combinations).
+		Groups are searched level by level in the lattice of column sets: since any superset of a table key 
+		is also a key, a group is only considered if all its sub-groups with one less column contain duplicates,
+		and its row codes are combined from the codes of its prefix group and its last column.
+	"""
+	num_rows = len(df)
+
+	# codes of each column, NaN values (code -1 from factorize) are shifted to code 0
+	col_codes, col_cards = [], []
+	for i in range(len(df.columns)):
+		codes, uniques = pd.factorize(df.iloc[:, i])
+		col_codes.append(codes.astype(np.int64) + 1)
+		col_cards.append(len(uniques) + 1)
+
+	# groups with duplicates at the current level, mapped to their row codes
+	level_groups = {(): np.zeros(num_rows, dtype=np.int64)}
+	results = []
+	for size in range(1, max_size + 1):
+		next_level_groups = {}
+		for prefix, prefix_codes in level_groups.items():
+			for j in range(prefix[-1] + 1 if prefix else 0, len(df.columns)):
+				check_deadline(deadline)
+				group = prefix + (j,)
+				# the group contains a key if any of its sub-groups (with one less column) is a key
+				if any([group[:k] + group[k + 1:] not in level_groups for k in range(size - 1)]):
+					continue
+				codes, uniques = pd.factorize(prefix_codes * col_cards[j] + col_codes[j])
+				if len(uniques) < num_rows:
+					next_level_groups[group] = codes.astype(np.int64)
+		results += list(next_level_groups.keys())
+		level_groups = next_level_groups
+		if len(level_groups) == 0:
+			break
+	return results
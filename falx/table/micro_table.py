@@ -0,0 +1,306 @@
+import copy
+import hashlib
+import math
+import re
+import json
+
+import pandas as pd
+
+from falx.table import eval_cache
+from falx.table.language import Table, get_fresh_col
+from falx.utils.deadline import check_deadline
+from falx.utils.profiler import profile
+
+
+class MicroTable(object):
+	"""A small column-oriented table: a list of column names and a list of columns (python lists).
+		It is a light replacement of pandas DataFrames for the small tables evaluated during synthesis,
+		and supports the parts of the DataFrame interface used by the search
+		(columns, size, equals, to_dict(orient="records")).
+	"""
+
+	__slots__ = ["names", "cols", "_fingerprint"]
+
+	def __init__(self, names, cols):
+		self.names = names
+		self.cols = cols
+		self._fingerprint = None
+
+	@staticmethod
+	def from_df(df):
+		return MicroTable(list(df.columns), [df.iloc[:, i].tolist() for i in range(len(df.columns))])
+
+	@staticmethod
+	def from_records(records):
+		# columns are ordered by their first appearance, missing values are NaN (like DataFrame.from_dict)
+		names = []
+		for r in records:
+			for k in r:
+				if k not in names:
+					names.append(k)
+		return MicroTable(names, [[r.get(k, math.nan) for r in records] for k in names])
+
+	def to_df(self):
+		if len(self.names) == 0:
+			return pd.DataFrame()
+		return pd.DataFrame({i: col for i, col in enumerate(self.cols)}).set_axis(self.names, axis=1)
+
+	@property
+	def columns(self):
+		return self.names
+
+	@property
+	def num_rows(self):
+		return len(self.cols[0]) if len(self.cols) > 0 else 0
+
+	@property
+	def size(self):
+		return self.num_rows * len(self.names)
+
+	def __len__(self):
+		return self.num_rows
+
+	def column(self, name):
+		return self.cols[self.names.index(name)]
+
+	def to_dict(self, orient="records"):
+		assert orient == "records", "[MicroTable] only records are supported."
+		return [dict(zip(self.names, row)) for row in zip(*self.cols)]
+
+	def equals(self, other):
+		return (isinstance(other, (MicroTable,)) and self.names == other.names
+					and all([columns_equal(c1, c2) for c1, c2 in zip(self.cols, other.cols)]))
+
+	def fingerprint(self):
+		"""a content fingerprint of the table (see synth_utils.table_fingerprint)"""
+		if self._fingerprint is None:
+			content = [[repr(n) for n in self.names]] + [[type(v).__name__ + ":" + repr(v) for v in col] for col in self.cols]
+			self._fingerprint = hashlib.sha1(json.dumps(content).encode()).hexdigest()
+		return self._fingerprint
+
+	def estimated_bytes(self):
+		return 64 * (len(self.names) + self.size)
+
+
+def is_null(v):
+	return v is None or (isinstance(v, float) and math.isnan(v))
+
+
+def columns_equal(c1, c2):
+	"""compare columns value by value, missing values are equal (like DataFrame.equals)"""
+	return len(c1) == len(c2) and all([x == y or (is_null(x) and is_null(y)) for x, y in zip(c1, c2)])
+
+
+def sort_unique(values):
+	"""distinct values in sorted order (or in the order of appearance if they cannot be compared)"""
+	uniques = list(dict.fromkeys(values))
+	try:
+		return sorted(uniques)
+	except TypeError:
+		return uniques
+
+
+def micro_eval(node, inputs, deadline=None):
+	"""evaluate a concrete program with micro tables, the result has the same content as node.eval
+		(sub-programs are evaluated with cached_micro_eval)"""
+	check_deadline(deadline)
+
+	if isinstance(node, (Table,)):
+		inp = inputs[node.data_id]
+		return MicroTable.from_records(inp) if isinstance(inp, (list,)) else MicroTable.from_df(inp)
+
+	t = cached_micro_eval(node.q, inputs, deadline)
+	handler = MICRO_OPERATORS.get(type(node).__name__)
+	if handler is not None:
+		result = handler(node, t)
+		if result is not None:
+			return result
+
+	# other operators are evaluated by pandas
+	q = copy.copy(node)
+	q.q = Table(0)
+	return MicroTable.from_df(q.eval([t.to_df()], deadline))
+
+
+def cached_micro_eval(node, inputs, deadline=None):
+	"""evaluate the node with micro tables, reusing the result of an identical sub-program
+		if an evaluation cache is active (micro tables and DataFrames are cached under different keys)"""
+	cache = eval_cache.get_active_cache()
+	if cache is None:
+		with profile("micro_eval", type(node).__name__):
+			return micro_eval(node, inputs, deadline)
+	prog_key, inputs_key = cache.make_key(node, inputs)
+	key = ("micro:" + prog_key, inputs_key)
+	t = cache.get(key)
+	if t is None:
+		with profile("micro_eval", type(node).__name__):
+			t = micro_eval(node, inputs, deadline)
+		cache.put(key, t)
+	return t
+
+
+def _select(node, t):
+	return MicroTable([t.names[i] for i in node.cols], [t.cols[i] for i in node.cols])
+
+
+def _unite(node, t):
+	new_col = get_fresh_col(list(t.names))[0]
+	c1, c2 = t.cols[node.col1], t.cols[node.col2]
+	for col in [c1, c2]:
+		# string concatenation fails on non-string columns (a column of NaN is a float column)
+		if (any([not is_null(v) and not isinstance(v, str) for v in col])
+				or (len(col) > 0 and all([isinstance(v, float) for v in col]))):
+			raise TypeError("can only concatenate str columns")
+	united = [math.nan if is_null(x) or is_null(y) else x + node.sep + y for x, y in zip(c1, c2)]
+	keep = [i for i in range(len(t.names)) if t.names[i] not in [t.names[node.col1], t.names[node.col2]]]
+	return MicroTable([t.names[i] for i in keep] + [new_col], [t.cols[i] for i in keep] + [united])
+
+
+def _separate(node, t):
+	col = t.cols[node.col_index]
+	if not any([isinstance(v, str) for v in col]):
+		raise AttributeError("Can only use .str accessor with string values!")
+	parts = [re.split(r"\s|_|-", v, maxsplit=1) if isinstance(v, str) else None for v in col]
+	if not any([p is not None and len(p) > 1 for p in parts]):
+		# pandas only creates a second column if some value is splitted
+		raise KeyError(1)
+	first = [p[0] if p is not None else math.nan for p in parts]
+	second = [(p[1] if len(p) > 1 else None) if p is not None else math.nan for p in parts]
+	new_col_names = get_fresh_col(list(t.names), n=2)
+	keep = [i for i in range(len(t.names)) if t.names[i] != t.names[node.col_index]]
+	return MicroTable([t.names[i] for i in keep] + new_col_names, [t.cols[i] for i in keep] + [first, second])
+
+
+def _spread(node, t):
+	key_col, val_col = t.names[node.key], t.names[node.val]
+	index_ids = [i for i in range(len(t.names)) if t.names[i] not in [key_col, val_col]]
+	if len(index_ids) == 0:
+		return None
+	keys = t.cols[node.key]
+	index_tuples = list(zip(*[t.cols[i] for i in index_ids]))
+	if any([is_null(k) for k in keys]) or any([is_null(v) for tp in index_tuples for v in tp]):
+		return None
+
+	cells = {}
+	for tp, k, v in zip(index_tuples, keys, t.cols[node.val]):
+		if (tp, k) in cells:
+			raise ValueError("Index contains duplicate entries, cannot reshape")
+		cells[(tp, k)] = v
+
+	rows, key_values = sort_unique(index_tuples), sort_unique(keys)
+	names = [t.names[i] for i in index_ids] + key_values
+	cols = [[tp[j] for tp in rows] for j in range(len(index_ids))]
+	cols += [[cells.get((tp, k), math.nan) for tp in rows] for k in key_values]
+	return MicroTable(names, cols)
+
+
+def _gather(node, t):
+	value_vars = [t.names[idx] for idx in node.value_columns]
+	key_ids = [i for i in range(len(t.names)) if t.names[i] not in value_vars]
+	if "VALUE" in t.names:
+		raise ValueError("value_name (VALUE) cannot match an element in the DataFrame columns.")
+	value_ids = [t.names.index(c) for c in value_vars]
+	cols = [t.cols[i] * len(value_ids) for i in key_ids]
+	cols.append([t.names[i] for i in value_ids for _ in range(t.num_rows)])
+	cols.append([v for i in value_ids for v in t.cols[i]])
+	return MicroTable([t.names[i] for i in key_ids] + ["KEY", "VALUE"], cols)
+
+
+def _aggregate(func, values):
+	values = [v for v in values if not is_null(v)]
+	if func == "count":
+		return len(values)
+	if any([not isinstance(v, (int, float)) for v in values]):
+		return None
+	if func == "sum":
+		return sum(values)
+	if func == "mean":
+		return sum(values) / len(values) if len(values) > 0 else math.nan
+	return None
+
+
+def _group_summary(node, t):
+	key_ids = list(node.group_cols)
+	target = t.names[node.aggr_col]
+	if target in [t.names[i] for i in key_ids] or node.aggr_func not in ["count", "sum", "mean"]:
+		return None
+
+	groups = {}
+	target_col = t.cols[node.aggr_col]
+	for r, key in enumerate(zip(*[t.cols[i] for i in key_ids])):
+		if any([is_null(k) for k in key]):
+			# groups with missing keys are dropped
+			continue
+		groups.setdefault(key, []).append(target_col[r])
+
+	keys = sort_unique(list(groups.keys()))
+	aggregated = [_aggregate(node.aggr_func, groups[k]) for k in keys]
+	if any([v is None for v in aggregated]):
+		return None
+	cols = [[k[j] for k in keys] for j in range(len(key_ids))] + [aggregated]
+	return MicroTable([t.names[i] for i in key_ids] + [f"{node.aggr_func}_{target}"], cols)
+
+
+def _cumsum(node, t):
+	col = t.cols[node.target]
+	if any([not is_null(v) and (not isinstance(v, (int, float)) or isinstance(v, bool)) for v in col]):
+		return None
+	result, total = [], 0
+	for v in col:
+		if is_null(v):
+			result.append(math.nan)
+		else:
+			total += v
+			result.append(total)
+	if "cumsum" in t.names:
+		return MicroTable(list(t.names), [result if n == "cumsum" else c for n, c in zip(t.names, t.cols)])
+	return MicroTable(t.names + ["cumsum"], t.cols + [result])
+
+
+def _mutate(node, t):
+	if node.op not in ["+", "-"]:
+		return None
+	c1, c2 = t.cols[node.col1], t.cols[node.col2]
+	if node.op == "+":
+		mutated = [math.nan if is_null(x) or is_null(y) else x + y for x, y in zip(c1, c2)]
+	else:
+		mutated = [math.nan if is_null(x) or is_null(y) else x - y for x, y in zip(c1, c2)]
+	new_col = get_fresh_col(list(t.names))[0]
+	return MicroTable(t.names + [new_col], t.cols + [mutated])
+
+
+# operators evaluated on micro tables, indexed by the operator class
+# (an operator returns None for arguments it does not handle, which are then evaluated by pandas)
+MICRO_OPERATORS = {
+	"Select": _select,
+	"Unite": _unite,
+	"Separate": _separate,
+	"Spread": _spread,
+	"Gather": _gather,
+	"GroupSummary": _group_summary,
+	"CumSum": _cumsum,
+	"Mutate": _mutate,
+}
+
+
+def records_equivalent(records1, records2):
+	"""compare tables in records form value by value (1 and 1.0 are equal, missing values are equal),
+		used to check micro tables against the pandas engine"""
+	if len(records1) != len(records2):
+		return False
+	for r1, r2 in zip(records1, records2):
+		if not columns_equal(list(r1.keys()), list(r2.keys())):
+			return False
+		for x, y in zip(r1.values(), r2.values()):
+			if is_null(x) and is_null(y):
+				continue
+			if isinstance(x, float) or isinstance(y, float):
+				try:
+					if round(float(x), 5) != round(float(y), 5):
+						return False
+					continue
+				except (TypeError, ValueError):
+					return False
+			if x != y:
+				return False
+	return True
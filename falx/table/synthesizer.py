@@ -4,12 +4,32 @@ import copy
 from pprint import pprint
 import pandas as pd
 import time
+import json
+import itertools
+import heapq
+import threading
+import multiprocessing
+import concurrent.futures
 
 from falx.table.language import (HOLE, Node, Table, Select, Unite, Filter, Separate, Spread, 
 	Gather, GroupSummary, CumSum, Mutate, MutateCustom)
 from falx.table import enum_strategies
 from falx.table import abstract_eval
-from falx.utils.synth_utils import remove_duplicate_columns, check_table_inclusion, align_table_schema
+from falx.table import eval_cache
+from falx.table import micro_table
+from falx.table import table_shape
+from falx.table.execution_plan import run_program
+from falx.utils.deadline import Deadline, DeadlineExceeded
+from falx.utils import profiler
+from falx.utils.profiler import profile
+from falx.utils.synth_utils import (remove_duplicate_columns, align_table_schema, 
+	table_fingerprint, column_value_sets)
+
+# how long (in seconds) to wait for a parallel worker to return after the time limit has passed
+WORKER_GRACE_PERIOD_SEC = 1
+
+# how many parallel searches can share a SketchWorkerPool at the same time
+MAX_CONCURRENT_SEARCHES = 64
 
 abstract_combinators = {
 	"select": lambda q: Select(q, cols=HOLE),
@@ -26,19 +46,48 @@ abstract_combinators = {
 
 def update_tree_value(node, path, new_val):
 	"""from a given ast node, locate the refence to the arg,
-	   and update the value"""
-	for k in path:
-		node = node["children"][k]
-	node["value"] = new_val
+	   and return a new ast with the value updated.
+	   The ast is treated as persistent: only nodes on the path from the root to the arg 
+	   are copied, all other subtrees are shared with the original ast (which is left unchanged)"""
+	if len(path) == 0:
+		return dict(node, value=new_val)
+	children = list(node["children"])
+	children[path[0]] = update_tree_value(children[path[0]], path[1:], new_val)
+	return dict(node, children=children)
 
 def get_node(node, path):
 	for k in path:
 		node = node["children"][k]
 	return node
 
+def program_key(ast):
+	"""canonical string representation of an ast, used for indexing programs"""
+	return json.dumps(ast, sort_keys=True, default=str)
+
+class Solution(object):
+	"""A program found by the search, with its output table (in records form, evaluated by pandas) and 
+		the mapping from columns of the expected output to columns of the table (see align_table_schema), 
+		both are computed when the program is confirmed, so that consumers don't evaluate and align it again.
+	"""
+
+	__slots__ = ["program", "output", "field_mapping"]
+
+	def __init__(self, program, output, field_mapping):
+		self.program = program
+		self.output = output
+		self.field_mapping = field_mapping
+
+	def to_dict(self):
+		return {"program": self.program.to_dict(), "output": self.output, "field_mapping": self.field_mapping}
+
+	@staticmethod
+	def load_from_dict(d):
+		return Solution(Node.load_from_dict(d["program"]), d["output"], d["field_mapping"])
+
+
 class Synthesizer(object):
 
-	def __init__(self, config=None):
+	def __init__(self, config=None, cache=None, worker_pool=None):
 		if config is None:
 			self.config = {
 				"operators": ["select", "unite", "filter", "separate", "spread", 
@@ -48,14 +97,34 @@ class Synthesizer(object):
 				"aggr_func": ["mean", "sum", "count"],
 				"mutate_op": ["+", "-"],
 				"gather_max_val_list_size": 3,
-				"gather_max_key_list_size": 3
+				"gather_max_key_list_size": 3,
+				"table_backend": "pandas"
 			}
 		else:
 			self.config = config
 
+		# cache of sub-program results, shared by all searches performed by this synthesizer
+		self.eval_cache = cache if cache is not None else eval_cache.EvalCache()
+
+		# the SketchWorkerPool used by parallel searches (a temporary pool is created per search if it is None)
+		self.worker_pool = worker_pool
+
+		# premises computed by backward evaluation, shared by all sketches searched by this synthesizer
+		self.premise_memo = abstract_eval.PremiseMemo()
+
+		# the number of candidate programs explored by the searches of this synthesizer (including pruned ones)
+		self.num_explored = 0
+
+		# maps (the key of) a representative sub-program to sub-programs pruned 
+		# because they produce the same intermediate table, see expand_equivalent_programs
+		self.equivalent_programs = {}
+
 	def enum_sketches(self, inputs, output, size):
 		"""enumerate program sketches up to the given size"""
+		with profile("enum_sketches"):
+			return self._enum_sketches(inputs, output, size)
 
+	def _enum_sketches(self, inputs, output, size):
 		# check if output contains a new value 
 		# (this decides if we should use ops that generates new vals)
 		
@@ -104,21 +173,20 @@ class Synthesizer(object):
 			return results
 		return get_paths_to_all_holes(ast)
 
-	def infer_domain(self, ast, var_path, inputs):
+	def infer_domain(self, ast, var_path, inputs, deadline=None):
 		node = Node.load_from_dict(get_node(ast, var_path[:-1]))
-		return node.infer_domain(arg_id=var_path[-1], inputs=inputs, config=self.config)
+		with profile("infer_domain", type(node).__name__):
+			return node.infer_domain(arg_id=var_path[-1], inputs=inputs, config=self.config, deadline=deadline)
 
-	def instantiate(self, ast, var_path, inputs):
+	def instantiate(self, ast, var_path, inputs, deadline=None):
 		"""instantiate one hole in the program sketch"""
-		domain = self.infer_domain(ast, var_path, inputs)
+		domain = self.infer_domain(ast, var_path, inputs, deadline)
 		candidates = []
 		for val in domain:
-			new_ast = copy.deepcopy(ast)
-			update_tree_value(new_ast, var_path, val)
-			candidates.append(new_ast)
+			candidates.append(update_tree_value(ast, var_path, val))
 		return candidates
 
-	def instantiate_one_level(self, ast, inputs):
+	def instantiate_one_level(self, ast, inputs, deadline=None):
 		"""generate program instantitated from the most recent level
 			i.e., given an abstract program, it will enumerate all possible abstract programs that concretize
 		"""
@@ -136,7 +204,7 @@ class Synthesizer(object):
 		for var_path in target_vars:
 			temp_candidates = []
 			for partial_prog in recent_candidates:
-				temp_candidates += self.instantiate(partial_prog, var_path, inputs)
+				temp_candidates += self.instantiate(partial_prog, var_path, inputs, deadline)
 			recent_candidates = temp_candidates
 
 		# for c in recent_candidates:
@@ -165,61 +233,139 @@ class Synthesizer(object):
 		else:
 			return [p]
 
-	def iteratively_instantiate_with_premises_check(self, p, inputs, premise_chains, time_limit_sec=None):
-		"""iteratively instantiate abstract programs w/ promise check """
-		
-		print("time limit: {}".format(time_limit_sec))
-		if time_limit_sec < 0:
-			return []
-
-		start_time = time.time()
-
-		def instantiate_with_premises_check(p, inputs, premise_chains):
-			"""instantiate programs and then check each one of them against the premise """
+	def iteratively_instantiate_with_premises_check(self, p, inputs, premise_chains, time_limit_sec=None, deadline=None):
+		"""iteratively instantiate abstract programs w/ promise check 
+			the search stops at the deadline (created from time_limit_sec if not provided) 
+			and returns programs found so far"""
+		if deadline is None:
+			deadline = Deadline(time_limit_sec)
+		return list(self.lazily_instantiate_with_premises_check(p, inputs, premise_chains, deadline))
+
+	def lazily_instantiate_with_premises_check(self, p, inputs, premise_chains, deadline):
+		"""a generator version of iteratively_instantiate_with_premises_check, 
+			concrete programs are yielded as soon as they pass all premise checks, 
+			and the search only proceeds as far as the consumer pulls"""
+		print("time limit: {}".format(deadline.remaining()))
+		yield from self.lazily_instantiate_ast_with_premises_check(p.to_dict(), inputs, premise_chains, deadline)
+
+	def lazily_instantiate_ast_with_premises_check(self, ast, inputs, premise_chains, deadline):
+		"""instantiate an abstract program in ast form, partial programs are kept as (structurally shared) asts 
+			through the recursion, and only concrete programs are loaded as Nodes when they are yielded"""
+		if deadline.expired():
+			return
+
+		if enum_strategies.count_holes(ast) == 0:
+			yield Node.load_from_dict(ast)
+			return
+
+		next_level_programs = self.expand_with_premises_check(ast, inputs, premise_chains, deadline)
+		while True:
+			try:
+				_ast, _ = next(next_level_programs)
+			except (StopIteration, DeadlineExceeded):
+				# stop (programs found so far are already yielded) when the deadline is reached
+				return
+			if deadline.expired():
+				return
+			yield from self.lazily_instantiate_ast_with_premises_check(_ast, inputs, premise_chains, deadline)
+
+	def expand_with_premises_check(self, ast, inputs, premise_chains, deadline):
+		"""instantiate holes at the innermost level of an abstract program (in ast form), 
+			and yield (ast, subquery result) for each instantiation that passes the premise check
+			(DeadlineExceeded is raised once the deadline has passed)"""
+
+		prune_equivalent = self.config.get("prune_equivalent_programs", True)
+		shape_check = self.config.get("shape_check", True)
+
+		# normalized values of premises, indexed by the id of the premise
+		premise_values = {}
+
+		next_level_programs, level = self.instantiate_one_level(ast, inputs, deadline)
+
+		# fingerprints of intermediate tables produced at this level, mapped to (representative program, table) pairs,
+		# used to only expand one representative program per equivalence class
+		seen_tables = {}
+
+		for _ast in next_level_programs:
+
+			# force terminate if the remaining time is running out
+			if deadline.expired():
+				return
+
+			self.num_explored += 1
+
+			premises_at_level = [[pm for pm in premise_chain if len(pm[1]) == level][0] for premise_chain in premise_chains]
+			# chains share premises (see abstract_eval.prune_subsumed_premises), each premise is checked once
+			premises_at_level = list({id(pm[0]): pm for pm in premises_at_level}.values())
+
+			if shape_check:
+				# premises that cannot be contained by the abstract output of the subquery are dropped 
+				# before evaluating it, and the program is rejected if no premise remains
+				with profile("shape_check"):
+					premises_at_level = [(premise, subquery_path) for premise, subquery_path in premises_at_level 
+											if self.shape_may_contain(_ast, subquery_path, premise, inputs, premise_values)]
+				if len(premises_at_level) == 0:
+					continue
+
+			subquery_res = None
+			if prune_equivalent and len(premises_at_level) > 0:
+				subquery_node = get_node(_ast, premises_at_level[0][1])
+				subquery = Node.load_from_dict(subquery_node)
+				print("  {}".format(subquery.stmt_string()))
+				subquery_res = self.eval_table(subquery, inputs, deadline)
+				fingerprint = table_fingerprint(subquery_res)
+				# equal fingerprints don't imply equal tables (e.g., hashing converts mixed-type values to strings), 
+				# so a hit is confirmed by comparing with the table of the representative
+				rep = [(rep_node, rep_res) for rep_node, rep_res in seen_tables.get(fingerprint, []) 
+							if rep_res.equals(subquery_res)]
+				if len(rep) > 0:
+					# observationally equivalent to a sibling that is already expanded
+					rep_key = program_key(rep[0][0])
+					self.equivalent_programs.setdefault(rep_key, []).append(subquery_node)
+					continue
+				seen_tables.setdefault(fingerprint, []).append((subquery_node, subquery_res))
+
+			subquery_values = None
+			for premise, subquery_path in premises_at_level:
+
+				if subquery_res is None:
+					# check if the subquery result contains the premise
+					subquery = Node.load_from_dict(get_node(_ast, subquery_path))
+					print("  {}".format(subquery.stmt_string()))
+					subquery_res = self.eval_table(subquery, inputs, deadline)
+
+				if subquery_values is None:
+					# columns of the subquery result are normalized once and checked against compiled premises
+					subquery_values = column_value_sets(subquery_res, deadline)
+
+				with profile("premise_check"):
+					included = self.premise_memo.premise_index(premise).included_by(subquery_values, deadline)
+				if included:
+					yield _ast, subquery_res
+					break
+
+	def shape_may_contain(self, ast, subquery_path, premise, inputs, premise_values):
+		"""check if the output shape of the subquery (see table_shape.TableShape) may include the premise, 
+			premise_values memoizes normalized values of premises"""
+		shape = Node.load_from_dict(get_node(ast, subquery_path)).cached_output_shape(inputs)
+		if shape is None:
+			return True
+		if id(premise) not in premise_values:
+			premise_values[id(premise)] = table_shape.premise_value_sets(premise)
+		return shape.may_contain(premise_values[id(premise)])
+
+	def expand_equivalent_programs(self, p):
+		"""given a program found by the search, enumerate all programs that are equivalent to it 
+			by substituting sub-programs that were pruned as observationally equivalent to its sub-programs"""
+		def expand(ast):
+			if ast["op"] == "table_ref":
+				return [ast]
 			results = []
-			if p.is_abstract():
-
-				print(p.stmt_string())
-				ast = p.to_dict()
-				next_level_programs, level = self.instantiate_one_level(ast, inputs)
-
-				for _ast in next_level_programs:
-
-					# force terminate if the remaining time is running out
-					if time_limit_sec is not None and time.time() - start_time > time_limit_sec:
-						return results
-
-					premises_at_level = [[pm for pm in premise_chain if len(pm[1]) == level][0] for premise_chain in premise_chains]
-
-					subquery_res = None
-					for premise, subquery_path in premises_at_level:
-
-						if subquery_res is None:
-							# check if the subquery result contains the premise
-							subquery_node = get_node(_ast, subquery_path)
-							print("  {}".format(Node.load_from_dict(subquery_node).stmt_string()))
-							subquery_res = Node.load_from_dict(subquery_node).eval(inputs)
-
-						if check_table_inclusion(premise.to_dict(orient="records"), subquery_res.to_dict(orient="records")):
-							#print(f"{' - '}{Node.load_from_dict(_ast).stmt_string()}")
-							results.append(Node.load_from_dict(_ast))
-							break
-
-				return results
-			else:
-				return []
-
-		results = []
-		if p.is_abstract():
-			candidates = instantiate_with_premises_check(p, inputs, premise_chains)
-			for _p in candidates:
-				if time_limit_sec is not None and time.time() - start_time > time_limit_sec:
-					return results
-				remaining_time_limit = time_limit_sec - (time.time() - start_time) if time_limit_sec is not None else None
-				results += self.iteratively_instantiate_with_premises_check(_p, inputs, premise_chains, remaining_time_limit)
+			for alt in [ast] + self.equivalent_programs.get(program_key(ast), []):
+				for child in expand(alt["children"][0]):
+					results.append(dict(alt, children=[child] + alt["children"][1:]))
 			return results
-		else:
-			return [p]
+		return [Node.load_from_dict(ast) for ast in expand(p.to_dict())]
 
 	def enumerative_all_programs(self, inputs, output, max_prog_size):
 		"""Given inputs and output, enumerate all programs in the search space until 
@@ -231,7 +377,7 @@ class Synthesizer(object):
 				concrete_programs += self.iteratively_instantiate_and_print(s, inputs, 1, True)
 		for p in concrete_programs:
 			try:
-				t = p.eval(inputs)
+				t = run_program(p, inputs)
 				print(p.stmt_string())
 				print(t)
 			except Exception as e:
@@ -252,7 +398,7 @@ class Synthesizer(object):
 				concrete_programs = self.iteratively_instantiate_and_print(s, inputs, 1)
 				for p in concrete_programs:
 					try:
-						t = p.eval(inputs)
+						t = run_program(p, inputs)
 						if align_table_schema(output, t.to_dict(orient="records")) != None:
 							print(p.stmt_string())
 							print(t)
@@ -266,41 +412,303 @@ class Synthesizer(object):
 		print(f"number of programs: {len(candidates)}")
 		return candidates
 
-	def enumerative_synthesis(self, inputs, output, max_prog_size, time_limit_sec=None, solution_limit=None):
-		"""Given inputs and output, enumerate all programs with premise check until 
-			find a solution p such that output ⊆ subseteq p(inputs) """
-
-		start_time = time.time()
-
-		all_sketches = self.enum_sketches(inputs, output, size=max_prog_size)
-		candidates = []
-		for level, sketches in all_sketches.items():
+	def synthesize_from_sketch(self, s, inputs, output, time_limit_sec=None, solution_limit=None, deadline=None, 
+							   return_solutions=False):
+		"""Given a program sketch, enumerate its instantiations with premise check and 
+			return those that are consistent with the output (at most solution_limit + 1 programs, 
+			or Solutions if return_solutions is true)
+			the search stops at the deadline (created from time_limit_sec if not provided)"""
+		if deadline is None:
+			deadline = Deadline(time_limit_sec)
+		max_num = solution_limit + 1 if solution_limit is not None else None
+		solutions = itertools.islice(
+			self.run_with_cache(self.lazily_synthesize_from_sketch(s, inputs, output, deadline)), max_num)
+		return [sol if return_solutions else sol.program for sol in solutions]
+
+	def lazily_synthesize_from_sketch(self, s, inputs, output, deadline):
+		"""a generator that yields instantiations of the sketch that are consistent with the output (as Solutions)"""
+		print(s.stmt_string())
+		try:
+			premise_chains = self.get_premise_chains(s.to_dict(), output, deadline)
+		except DeadlineExceeded:
+			return
+
+		for p in self.lazily_instantiate_with_premises_check(s, inputs, premise_chains, deadline):
+			try:
+				# check table consistensy
+				t = self.eval_table(p, inputs, deadline)
+				solution = self.check_solution(p, t, inputs, output, deadline)
+			except DeadlineExceeded:
+				return
+			if solution is not None:
+				yield solution
+
+	def check_solution(self, p, t, inputs, output, deadline=None):
+		"""check if the output is contained by the table t evaluated from the concrete program p, 
+			returns a Solution if it is (None otherwise)"""
+		records = t.to_dict(orient="records")
+		with profile("align_table_schema"):
+			field_mapping = align_table_schema(output, records, deadline=deadline)
+		if field_mapping is None:
+			return None
+		if not isinstance(t, (pd.DataFrame,)):
+			# solutions carry tables evaluated by pandas (other table backends only speed up the search), 
+			# the program is re-run on the inputs with its execution plan
+			records = run_program(p, inputs, deadline).to_dict(orient="records")
+		return Solution(p, records, field_mapping)
+
+	def eval_table(self, p, inputs, deadline=None):
+		"""evaluate a program during the search with the table backend selected by the "table_backend" option:
+			"pandas" (DataFrames) or "micro" (micro_table.MicroTable, faster on small tables),
+			both backends produce tables with the same content"""
+		if self.config.get("table_backend", "pandas") == "micro":
+			return micro_table.cached_micro_eval(p, inputs, deadline)
+		return p.cached_eval(inputs, deadline)
+
+	def get_premise_chains(self, ast, output, deadline):
+		"""all premise chains of the sketch (in ast form) for the output, computed by backward evaluation"""
+		out_df = pd.DataFrame.from_dict(output)
+		out_df = remove_duplicate_columns(out_df)
+		with profile("backward_eval"):
+			return abstract_eval.backward_eval(ast, out_df, deadline=deadline, memo=self.premise_memo)
+
+	def lazily_best_first_synthesis(self, sketches, inputs, output, deadline):
+		"""a generator that explores partial programs from all sketches in the order of their cost 
+			(given by the cost model selected by the "cost_model" option, see enum_strategies.cost_models),
+			such that partial programs from different sketches are interleaved, 
+			and yields concrete programs that are consistent with the output (as Solutions)"""
+		cost_model = enum_strategies.cost_models[self.config.get("cost_model", "estimated")]
+
+		# the frontier contains (cost, tie breaker, ast, premise chains of its sketch), 
+		# the tie breaker keeps programs with the same cost in the order they are found
+		frontier = []
+		counter = itertools.count()
+
+		try:
 			for s in sketches:
-				print(s.stmt_string())
 				ast = s.to_dict()
-				out_df = pd.DataFrame.from_dict(output)
+				premise_chains = self.get_premise_chains(ast, output, deadline)
+				heapq.heappush(frontier, (cost_model(ast, inputs, premise_chains, None), next(counter), ast, premise_chains))
+
+			while len(frontier) > 0 and not deadline.expired():
+				cost, _, ast, premise_chains = heapq.heappop(frontier)
+				if enum_strategies.count_holes(ast) > 0:
+					for _ast, subquery_res in self.expand_with_premises_check(ast, inputs, premise_chains, deadline):
+						_cost = cost_model(_ast, inputs, premise_chains, subquery_res)
+						heapq.heappush(frontier, (_cost, next(counter), _ast, premise_chains))
+				else:
+					# check table consistensy
+					p = Node.load_from_dict(ast)
+					t = self.eval_table(p, inputs, deadline)
+					solution = self.check_solution(p, t, inputs, output, deadline)
+					if solution is not None:
+						yield solution
+		except DeadlineExceeded:
+			# stop (programs found so far are already yielded) when the deadline is reached
+			return
+
+	def run_with_cache(self, gen):
+		"""drive a generator with the evaluation cache of this synthesizer active, 
+			the cache is only active while the generator runs (not while the consumer holds a result)"""
+		while True:
+			with eval_cache.activate(self.eval_cache):
+				try:
+					item = next(gen)
+				except StopIteration:
+					return
+			yield item
+
+	def enumerative_synthesis(self, inputs, output, max_prog_size, time_limit_sec=None, solution_limit=None, 
+							  num_workers=None, return_solutions=False):
+		"""Given inputs and output, enumerate all programs with premise check until 
+			find a solution p such that output ⊆ subseteq p(inputs) 
+			If num_workers > 1, sketches are explored in parallel by the worker pool of the synthesizer 
+			(or a temporary pool with num_workers processes), results are still returned in the order of sketches
+			Programs are returned, or Solutions (programs with their output tables and field mappings) 
+			if return_solutions is true"""
+
+		if num_workers is not None and num_workers > 1:
+			assert self.config.get("search_strategy", "depth_first") == "depth_first", \
+				"[Synthesizer] best-first search can only run sequentially (num_workers = 1)."
+			deadline = Deadline(time_limit_sec)
+			if self.worker_pool is not None:
+				solutions = self.parallel_enumerative_synthesis(inputs, output, max_prog_size, 
+								deadline, solution_limit, self.worker_pool)
+			else:
+				with SketchWorkerPool(num_workers) as pool:
+					solutions = self.parallel_enumerative_synthesis(inputs, output, max_prog_size, 
+									deadline, solution_limit, pool)
+			return [sol if return_solutions else sol.program for sol in solutions]
+
+		return list(self.enumerative_synthesis_iter(inputs, output, max_prog_size, time_limit_sec, solution_limit, 
+													return_solutions=return_solutions))
+
+	def enumerative_synthesis_iter(self, inputs, output, max_prog_size, time_limit_sec=None, solution_limit=None, 
+								   num_workers=None, return_solutions=False):
+		"""A generator version of enumerative_synthesis: 
+			programs (or Solutions) are yielded as soon as they are confirmed consistent with the output, 
+			the search only proceeds as far as the consumer pulls 
+			(except for the parallel search, which collects all results before yielding them)"""
+		if num_workers is not None and num_workers > 1:
+			return iter(self.enumerative_synthesis(inputs, output, max_prog_size, time_limit_sec, solution_limit, 
+												   num_workers, return_solutions))
+		max_num = solution_limit + 1 if solution_limit is not None else None
+		solutions = itertools.islice(self.run_with_cache(
+			self.lazily_enumerative_synthesis(inputs, output, max_prog_size, time_limit_sec)), max_num)
+		return (sol if return_solutions else sol.program for sol in solutions)
+
+	def lazily_enumerative_synthesis(self, inputs, output, max_prog_size, time_limit_sec):
+		deadline = Deadline(time_limit_sec)
+		self.equivalent_programs = {}
 
-				out_df = remove_duplicate_columns(out_df)
-				# all premise chains for the given ast
-				premise_chains = abstract_eval.backward_eval(ast, out_df)
+		all_sketches = self.enum_sketches(inputs, output, size=max_prog_size)
 
-				remaining_time_limit = time_limit_sec - (time.time() - start_time) if time_limit_sec is not None else None
-				programs = self.iteratively_instantiate_with_premises_check(s, inputs, premise_chains, remaining_time_limit)
-				
-				for p in programs:
-					# check table consistensy
-					t = p.eval(inputs)
-					alignment_result = align_table_schema(output, t.to_dict(orient="records"))
-					if alignment_result != None:
-						candidates.append(p)
+		if self.config.get("search_strategy", "depth_first") == "best_first":
+			sketches = [s for level, level_sketches in all_sketches.items() for s in level_sketches]
+			yield from self.lazily_best_first_synthesis(sketches, inputs, output, deadline)
+			return
 
-					if solution_limit is not None and len(candidates) > solution_limit:
-						return candidates
-				
-				# early return if the termination condition is met
-				# TODO: time_limit may be exceeded if the synthesizer is stuck on iteratively instantiation
-				if time_limit_sec is not None and time.time() - start_time > time_limit_sec:
-					return candidates
+		for level, sketches in all_sketches.items():
+			for s in sketches:
+				yield from self.lazily_synthesize_from_sketch(s, inputs, output, deadline)
+
+				# early return if the termination condition is met 
+				# (the search within a sketch stops at the deadline with a bounded overshoot)
+				if deadline.expired():
+					return
+
+	def submit_enumerative_synthesis(self, inputs, output, max_prog_size, deadline, solution_limit, pool):
+		"""start exploring all sketches for the output in a SketchWorkerPool without waiting for them, 
+			returns the search, whose Solutions are collected by collect_solutions 
+			(so that several searches, e.g., for the layers of a chart, can be explored by the pool at the same time)"""
+		self.equivalent_programs = {}
+		all_sketches = self.enum_sketches(inputs, output, size=max_prog_size)
+		sketches = [s for level, level_sketches in all_sketches.items() for s in level_sketches]
+		return self.submit_sketches(sketches, inputs, output, deadline, solution_limit, pool)
+
+	def submit_sketches(self, sketches, inputs, output, deadline, solution_limit, pool):
+		"""start exploring sketches in a SketchWorkerPool without waiting for them, 
+			returns the search (the slot it owns in the pool and the futures of sketches)"""
+		slot, search_id = pool.start_search()
+		# workers profile their searches if this search is profiled
+		profiled = profiler.get_active_profiler() is not None
+		try:
+			futures = [pool.executor.submit(_explore_sketch, self.config, s.to_dict(), inputs, output, 
+											deadline.end_time, solution_limit, slot, search_id, profiled) 
+							for s in sketches]
+		except Exception:
+			pool.stop_search(slot)
+			raise
+		return slot, futures
+
+	def collect_solutions(self, search, deadline, solution_limit, pool):
+		"""wait for the sketches of a search started by submit_sketches, the solution limit and the deadline 
+			are enforced globally: once the solutions from (a prefix of) the sketches reach the limit, 
+			all workers of the search are stopped, returns the Solutions found"""
+		slot, futures = search
+		active_profiler = profiler.get_active_profiler()
 
+		candidates = []
+		try:
+			# collect results in the order of sketches so that the result is deterministic
+			for future in futures:
+				remaining_time_limit = deadline.remaining()
+				try:
+					# workers check the deadline themselves, allow a short grace period for them to return
+					timeout = max(remaining_time_limit, 0) + WORKER_GRACE_PERIOD_SEC if remaining_time_limit is not None else None
+					solutions, equivalent_programs, num_explored, report = future.result(timeout=timeout)
+				except concurrent.futures.TimeoutError:
+					break
+
+				self.num_explored += num_explored
+				if report is not None and active_profiler is not None:
+					active_profiler.merge(report)
+				for key, variants in equivalent_programs.items():
+					self.equivalent_programs.setdefault(key, []).extend(variants)
+				candidates += [Solution.load_from_dict(sol) for sol in solutions]
+
+				if solution_limit is not None and len(candidates) > solution_limit:
+					candidates = candidates[:solution_limit + 1]
+					break
+		finally:
+			# stop workers that are still running and drop sketches that are not started
+			pool.stop_search(slot)
+			for future in futures:
+				future.cancel()
 
 		return candidates
+
+	def parallel_enumerative_synthesis(self, inputs, output, max_prog_size, deadline, solution_limit, pool):
+		"""explore all sketches for the output in a SketchWorkerPool, returns the Solutions found"""
+		search = self.submit_enumerative_synthesis(inputs, output, max_prog_size, deadline, solution_limit, pool)
+		return self.collect_solutions(search, deadline, solution_limit, pool)
+
+
+class SketchWorkerPool(object):
+	"""A process pool used by parallel searches to explore sketches. 
+		The pool is meant to be created once (e.g., per server) and shared by searches, 
+		so that worker processes (and the modules they import) are reused across requests.
+		Each running search owns a slot in a shared memory array that holds its search id,
+		workers of the search stop once the slot holds a different value.
+	"""
+
+	def __init__(self, num_workers):
+		self.num_workers = num_workers
+		self._search_slots = multiprocessing.RawArray("q", [-1] * MAX_CONCURRENT_SEARCHES)
+		self._free_slots = list(range(MAX_CONCURRENT_SEARCHES))
+		self._search_ids = itertools.count()
+		self._lock = threading.Lock()
+		self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, 
+							initializer=_init_sketch_worker, initargs=(self._search_slots,))
+
+	def start_search(self):
+		"""reserve a slot for a new search, returns the slot and the id of the search"""
+		with self._lock:
+			assert len(self._free_slots) > 0, "[SketchWorkerPool] too many concurrent searches."
+			slot = self._free_slots.pop()
+			search_id = next(self._search_ids)
+			self._search_slots[slot] = search_id
+		return slot, search_id
+
+	def stop_search(self, slot):
+		"""stop workers of the search in the slot and release the slot"""
+		with self._lock:
+			self._search_slots[slot] = -1
+			self._free_slots.append(slot)
+
+	def shutdown(self):
+		self.executor.shutdown(wait=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.shutdown()
+
+
+# the search slots of the pool a sketch worker process belongs to (set by _init_sketch_worker)
+_worker_search_slots = None
+
+# the evaluation cache of a sketch worker process (set by _init_sketch_worker), it is shared by all sketches 
+# the worker explores (across searches), entries are keyed by the content of inputs so they never go stale
+_worker_eval_cache = None
+
+def _init_sketch_worker(search_slots):
+	global _worker_search_slots, _worker_eval_cache
+	_worker_search_slots = search_slots
+	_worker_eval_cache = eval_cache.EvalCache()
+
+def _explore_sketch(config, sketch_ast, inputs, output, end_time, solution_limit, slot, search_id, profiled=False):
+	"""explore one sketch in a worker process until end_time (an absolute time stamp, or None) 
+		or until the search (identified by its slot and id) is stopped, 
+		returns the solutions found (in dict form), the equivalent programs recorded during the search, 
+		the number of candidates explored and the profiler report of the search (None if it is not profiled)"""
+	synthesizer = Synthesizer(config=config, cache=_worker_eval_cache)
+	deadline = Deadline(end_time - time.time() if end_time is not None else None, 
+						is_cancelled=lambda: _worker_search_slots[slot] != search_id)
+	worker_profiler = profiler.Profiler() if profiled else None
+	with profiler.activate(worker_profiler):
+		solutions = synthesizer.synthesize_from_sketch(Node.load_from_dict(sketch_ast), inputs, output, 
+													   solution_limit=solution_limit, deadline=deadline, return_solutions=True)
+	report = worker_profiler.report() if profiled else None
+	return [sol.to_dict() for sol in solutions], synthesizer.equivalent_programs, synthesizer.num_explored, report
@@ -0,0 +1,118 @@
+import math
+
+import numpy as np
+
+from falx.utils.synth_utils import construct_value_dict
+
+# values are rounded to 5 digits when tables are compared, so ranges are checked up to this tolerance
+RANGE_TOLERANCE = 1e-5
+
+
+def is_null(v):
+	return v is None or (isinstance(v, (float, np.floating)) and math.isnan(v))
+
+
+def is_number(v):
+	return isinstance(v, (bool, int, float, np.number, np.bool_)) and not is_null(v)
+
+
+def value_range(values):
+	"""the range (lo, hi) of values if they are all numbers or missing values (None otherwise)"""
+	numbers = [v for v in values if not is_null(v)]
+	if len(numbers) == 0 or not all([is_number(v) for v in numbers]):
+		return None
+	return (float(min(numbers)), float(max(numbers)))
+
+
+def range_hull(ranges):
+	"""the smallest range containing all ranges (None if any range is unknown)"""
+	if len(ranges) == 0 or any([r is None for r in ranges]):
+		return None
+	return (min([r[0] for r in ranges]), max([r[1] for r in ranges]))
+
+
+class ColumnShape(object):
+	"""The abstraction of a column: the exact set of its values (None if unknown),
+		and a range (lo, hi) containing all of its values if it only contains numbers and missing values (None if unknown).
+	"""
+
+	__slots__ = ["values", "value_range", "_normalized"]
+
+	def __init__(self, values=None, value_range=None):
+		self.values = values
+		self.value_range = value_range
+		self._normalized = None
+
+	@staticmethod
+	def from_values(values):
+		try:
+			value_set = frozenset(values)
+		except TypeError:
+			value_set = None
+		return ColumnShape(value_set, value_range(values))
+
+	def superset(self):
+		"""the abstraction of a column containing a subset of the values of this column"""
+		return ColumnShape(None, self.value_range)
+
+	def has_null(self):
+		return self.values is None or any([is_null(v) for v in self.values])
+
+	def may_contain(self, keys):
+		"""check if the column may contain all keys (normalized values, see premise_value_sets)"""
+		if self.values is not None:
+			if self._normalized is None:
+				# the column is normalized as a whole (like in check_table_inclusion),
+				# which only depends on the set of values in the column
+				self._normalized = construct_value_dict(list(self.values)).keys()
+			return keys <= self._normalized
+		if self.value_range is not None:
+			lo, hi = self.value_range
+			return all([is_number(k) and lo - RANGE_TOLERANCE <= k <= hi + RANGE_TOLERANCE for k in keys])
+		return True
+
+
+class TableShape(object):
+	"""The abstraction of a table: its column names, the shape of each column, and an upper bound of its number of rows.
+		Shapes are computed by Node.infer_output_shape without evaluating the program, and
+		a table whose shape does not contain a premise can never include it (see check_table_inclusion).
+	"""
+
+	__slots__ = ["names", "columns", "max_rows"]
+
+	def __init__(self, names, columns, max_rows):
+		self.names = names
+		self.columns = columns
+		self.max_rows = max_rows
+
+	@staticmethod
+	def from_df(df):
+		if df.columns.duplicated().any():
+			# operators refer to columns by names, which are ambiguous
+			return None
+		return TableShape(list(df.columns), [ColumnShape.from_values(df.iloc[:, i].tolist())
+												for i in range(len(df.columns))], len(df))
+
+	def column(self, name):
+		return self.columns[self.names.index(name)]
+
+	def may_contain(self, value_sets):
+		"""check if a table of this shape may include a premise (given by premise_value_sets):
+			each column of the premise should be contained by some column of the table"""
+		if value_sets is None:
+			return True
+		for keys in value_sets:
+			if len(keys) > self.max_rows:
+				return False
+			if not any([c.may_contain(keys) for c in self.columns]):
+				return False
+		return True
+
+
+def premise_value_sets(premise):
+	"""the normalized values in each column of a premise table (None if the premise is empty),
+		missing values are dropped as they are compared by identity"""
+	if len(premise) == 0:
+		return None
+	return [set([k for k in construct_value_dict(premise.iloc[:, i].tolist()).keys() if not is_null(k)])
+				for i in range(len(premise.columns))]
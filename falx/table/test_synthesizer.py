@@ -2,9 +2,16 @@ import unittest
 
 from falx.table.language import *
 from falx.table.synthesizer import *
+from falx.utils.synth_utils import construct_value_dict, check_table_inclusion, PremiseIndex
+from falx.utils import profiler
 import os
 
 
+def _worker_cache_misses():
+	from falx.table import synthesizer
+	return synthesizer._worker_eval_cache.misses
+
+
 class TestSynthesizer(unittest.TestCase):
 
 	#@unittest.skip
@@ -210,6 +217,226 @@ class TestSynthesizer(unittest.TestCase):
 			print(p.stmt_string())
 			print(p.eval(inputs))
 
+	def test_update_tree_value(self):
+		ast = Gather(Spread(Table(data_id=0), key=HOLE, val=HOLE), value_columns=HOLE).to_dict()
+		new_ast = update_tree_value(ast, [0, 1], 2)
+		self.assertEqual(get_node(new_ast, [0, 1])["value"], 2)
+		# the original ast is unchanged and untouched subtrees are shared
+		self.assertEqual(get_node(ast, [0, 1])["value"], HOLE)
+		self.assertTrue(get_node(new_ast, [0, 0]) is get_node(ast, [0, 0]))
+		self.assertTrue(new_ast["children"][1] is ast["children"][1])
+
+	def test_align_table_schema(self):
+		table2 = [{"k": "A", "a": 1, "b": 2}, {"k": "B", "a": 2, "b": 1}, {"k": "C", "a": 2, "b": 2}]
+		# x and color are equal, so both are mapped to the same column
+		table1 = [{"x": "A", "color": "A", "y": 2}, {"x": "B", "color": "B", "y": 1}]
+		self.assertEqual(align_table_schema(table1, table2), {"x": "k", "color": "k", "y": "b"})
+		# y can be mapped to a or b, but only y -> b is consistent with z -> a in rows
+		self.assertEqual(align_table_schema([{"y": 2, "z": 1}], [{"a": 1, "b": 2}, {"a": 2, "b": 3}]), {"y": "b", "z": "a"})
+		# each column can be mapped, but no row contains both values
+		table2 = [{"a": 1, "b": 1}, {"a": 2, "b": 2}]
+		self.assertEqual(align_table_schema([{"y": 1, "z": 2}, {"y": 2, "z": 1}], table2), None)
+		self.assertTrue(align_table_schema([{"y": 1, "z": 2}, {"y": 2, "z": 1}], table2, boolean_result=True))
+		# absent keys are skipped when rows are compared, so {"y": 3} matches {"a": 3}
+		table2 = [{"a": 1, "b": 2}, {"a": 3}, {"a": 5, "b": 3}]
+		self.assertEqual(align_table_schema([{"x": 1, "y": 2}, {"y": 3}], table2), {"x": "a", "y": "b"})
+
+	def test_table_inclusion(self):
+		self.assertEqual(construct_value_dict([1, 2.000001, 1.0]), {1: 2, 2: 1})
+		self.assertEqual(construct_value_dict(["a", "1", "a"]), {"a": 2, 1: 1})
+		table2 = [{"k": "A", "a": 1}, {"k": "B", "a": 2.5}]
+		self.assertTrue(check_table_inclusion([{"x": 2.5, "y": "B"}], table2))
+		self.assertFalse(check_table_inclusion([{"x": 3, "y": "B"}], table2))
+		self.assertTrue(check_table_inclusion([{"x": UNKNOWN, "y": "B"}], table2, wild_card=UNKNOWN))
+		# a compiled premise is checked against the columns of records, dataframes and micro tables
+		index = PremiseIndex(pd.DataFrame({"x": [UNKNOWN, 1], "y": ["B", "A"]}), wild_card=UNKNOWN)
+		for table in [table2, pd.DataFrame(table2), micro_table.MicroTable.from_records(table2)]:
+			self.assertTrue(index.included_by(column_value_sets(table)))
+		self.assertFalse(PremiseIndex(pd.DataFrame({"x": [3]})).included_by(column_value_sets(table2)))
+		self.assertTrue(PremiseIndex(pd.DataFrame({"x": []})).included_by([]))
+
+	def test_remove_duplicate_columns(self):
+		df = pd.DataFrame({"a": [1, 2], "b": ["x", "y"], "c": [1.0, 2.0], "d": ["x", "y"], "e": [1, "y"]})
+		self.assertEqual(list(remove_duplicate_columns(df).columns), ["a", "b", "e"])
+
+	def test_prune_equivalent_programs(self):
+		inputs = [[{"x": "A", "a": 1, "b": 1}, {"x": "B", "a": 2, "b": 2}]]
+		output = [{"c_x": "A", "c_y": 1}, {"c_x": "B", "c_y": 3}]
+
+		synthesizer = Synthesizer()
+		candidates = synthesizer.enumerative_synthesis(inputs, output, 1, time_limit_sec=10)
+		self.assertEqual([p.stmt_string() for p in candidates], ["t0 <- table_ref(0); t1 <- cumsum(t0, 1)"])
+
+		# cumsum over column 2 produces the same table, it is recovered by expansion
+		expanded = [q.stmt_string() for p in candidates for q in synthesizer.expand_equivalent_programs(p)]
+		self.assertIn("t0 <- table_ref(0); t1 <- cumsum(t0, 2)", expanded)
+
+		# tables with the same fingerprint are only pruned if they are equal
+		t1, t2 = pd.DataFrame({"c": [1, "a"]}), pd.DataFrame({"c": ["1", "a"]})
+		self.assertEqual(table_fingerprint(t1), table_fingerprint(t2))
+		cache = eval_cache.EvalCache()
+		cache.put(cache.make_key(CumSum(Table(data_id=0), 1), inputs), t1)
+		cache.put(cache.make_key(CumSum(Table(data_id=0), 2), inputs), t2)
+		# (the shape check would reject the cached tables, which are not the results of the programs)
+		synthesizer = Synthesizer(dict(Synthesizer().config, shape_check=False))
+		premise_chains = [[(pd.DataFrame({"c": ["a"]}), []), (pd.DataFrame({"c": ["a"]}), [0])]]
+		with eval_cache.activate(cache):
+			expanded = list(synthesizer.expand_with_premises_check(
+				CumSum(Table(data_id=0), HOLE).to_dict(), inputs, premise_chains, Deadline(10)))
+		self.assertEqual(len(expanded), 2)
+		self.assertEqual(synthesizer.equivalent_programs, {})
+
+	def test_premise_chains(self):
+		output = [{"c_x": "Y1", "c_y": 0.52}, {"c_x": "Y2", "c_y": 0.57}, {"c_x": "Y3", "c_y": 0.6}]
+		synthesizer = Synthesizer()
+		ast = Gather(Spread(Table(data_id=0), HOLE, HOLE), HOLE).to_dict()
+		chains = synthesizer.get_premise_chains(ast, output, Deadline(10))
+		# chains are memoized for the operators (arguments are not used)
+		ast = Gather(Spread(Table(data_id=0), 1, 2), HOLE).to_dict()
+		self.assertTrue(synthesizer.get_premise_chains(ast, output, Deadline(10)) is chains)
+		# premises at the same path never subsume each other
+		for level in range(3):
+			premises = list({id(c[level][0]): c[level][0] for c in chains}.values())
+			for df1, df2 in itertools.permutations(premises, 2):
+				self.assertFalse(abstract_eval.premise_included(df1, df2, {}))
+
+		# a premise including another premise at the same path is replaced by it
+		out_df = pd.DataFrame({"a": [1, 2]})
+		weak, strong = pd.DataFrame({"a": [1]}), pd.DataFrame({"a": [1], "b": ["x"]})
+		chains = [[(out_df, []), (strong, [0])], [(out_df, []), (weak, [0])]]
+		pruned = abstract_eval.prune_subsumed_premises(chains)
+		self.assertEqual(len(pruned), 1)
+		self.assertTrue(pruned[0][1][0] is weak)
+
+	def test_shape_check(self):
+		inputs = [[{"x": "A", "a": 1, "b": 1}, {"x": "B", "a": 2, "b": 2}]]
+		ast = CumSum(Table(data_id=0), HOLE).to_dict()
+
+		# no cumsum can produce 5, so candidates are rejected without being evaluated
+		premise_chains = [[(pd.DataFrame({"c": [5]}), []), (pd.DataFrame({"c": [5]}), [0])]]
+		cache = eval_cache.EvalCache()
+		with eval_cache.activate(cache):
+			expanded = list(Synthesizer().expand_with_premises_check(ast, inputs, premise_chains, Deadline(10)))
+		self.assertEqual(expanded, [])
+		self.assertEqual(len(cache), 0)
+
+		premise_chains = [[(pd.DataFrame({"c": [3]}), []), (pd.DataFrame({"c": [3]}), [0])]]
+		config = dict(Synthesizer().config, prune_equivalent_programs=False)
+		with_check = list(Synthesizer(config).expand_with_premises_check(ast, inputs, premise_chains, Deadline(10)))
+		config = dict(config, shape_check=False)
+		without_check = list(Synthesizer(config).expand_with_premises_check(ast, inputs, premise_chains, Deadline(10)))
+		self.assertEqual([a for a, _ in with_check], [a for a, _ in without_check])
+		self.assertEqual(len(with_check), 2)
+
+	def test_parallel_synthesis(self):
+		inputs = [[
+			{"Value":"means","Y1":0.52,"Y2":0.57,"Y3":0.6,"Y4":0.63,"Y5":0.63},
+			{"Value":"stddev","Y1":0.1328,"Y2":0.1321,"Y3":0.1303,"Y4":0.1266,"Y5":0.1225},
+			{"Value":"upper range","Y1":0.66,"Y2":0.7,"Y3":0.73,"Y4":0.75,"Y5":0.75},
+			{"Value":"lower range","Y1":0.39,"Y2":0.44,"Y3":0.47,"Y4":0.5,"Y5":0.51}
+		]]
+		output = [{"c_x": "Y1", "c_y": 0.52}, {"c_x": "Y2", "c_y": 0.57}, {"c_x": "Y3", "c_y": 0.6}]
+
+		sequential = Synthesizer().enumerative_synthesis(inputs, output, 2, time_limit_sec=30, solution_limit=3)
+		parallel = Synthesizer().enumerative_synthesis(inputs, output, 2, time_limit_sec=30, solution_limit=3, num_workers=2)
+		self.assertEqual([p.stmt_string() for p in parallel], [p.stmt_string() for p in sequential])
+
+		# a worker pool can be shared by searches
+		with SketchWorkerPool(2) as pool:
+			for _ in range(2):
+				parallel = Synthesizer(worker_pool=pool).enumerative_synthesis(inputs, output, 2, 
+								time_limit_sec=30, solution_limit=3, num_workers=2)
+				self.assertEqual([p.stmt_string() for p in parallel], [p.stmt_string() for p in sequential])
+
+		# a worker reuses sub-programs evaluated for the sketches it explored before (across searches)
+		with SketchWorkerPool(1) as pool:
+			misses = []
+			for _ in range(2):
+				Synthesizer(worker_pool=pool).enumerative_synthesis(inputs, output, 2, 
+					time_limit_sec=30, solution_limit=3, num_workers=2)
+				misses.append(pool.executor.submit(_worker_cache_misses).result())
+			self.assertTrue(misses[0] > 0)
+			self.assertEqual(misses[1], misses[0])
+
+		config = dict(Synthesizer().config, search_strategy="best_first")
+		with self.assertRaises(AssertionError):
+			Synthesizer(config).enumerative_synthesis(inputs, output, 2, time_limit_sec=30, num_workers=2)
+
+	def test_table_backend(self):
+		inputs = [[{"x": "A", "a": 1, "b": 1}, {"x": "B", "a": 2, "b": 2}]]
+		output = [{"c_x": "A", "c_y": 1}, {"c_x": "B", "c_y": 3}]
+
+		expected = Synthesizer().enumerative_synthesis(inputs, output, 2, time_limit_sec=30)
+		config = dict(Synthesizer().config, table_backend="micro")
+		candidates = Synthesizer(config).enumerative_synthesis(inputs, output, 2, time_limit_sec=30)
+		self.assertEqual([p.stmt_string() for p in candidates], [p.stmt_string() for p in expected])
+		# solutions carry the output table (evaluated by pandas) and the field mapping of their programs
+		solutions = Synthesizer(config).enumerative_synthesis(inputs, output, 2, time_limit_sec=30, return_solutions=True)
+		self.assertEqual([sol.program.stmt_string() for sol in solutions], [p.stmt_string() for p in expected])
+		for sol in solutions:
+			records = sol.program.eval(inputs).to_dict(orient="records")
+			self.assertEqual(sol.output, records)
+			self.assertEqual(sol.field_mapping, align_table_schema(output, records))
+
+	def test_profiler(self):
+		inputs = [[{"x": "A", "a": 1, "b": 1}, {"x": "B", "a": 2, "b": 2}]]
+		output = [{"c_x": "A", "c_y": 1}, {"c_x": "B", "c_y": 3}]
+
+		expected = Synthesizer().enumerative_synthesis(inputs, output, 2, time_limit_sec=30)
+		search_profiler = profiler.Profiler()
+		with profiler.activate(search_profiler):
+			synthesizer = Synthesizer()
+			candidates = synthesizer.enumerative_synthesis(inputs, output, 2, time_limit_sec=30)
+		self.assertEqual([p.stmt_string() for p in candidates], [p.stmt_string() for p in expected])
+		report = search_profiler.report()
+		for stage in ["enum_sketches", "backward_eval", "infer_domain.CumSum", "eval.CumSum", "premise_check", "align_table_schema"]:
+			self.assertTrue(report[stage]["count"] > 0)
+		self.assertTrue(synthesizer.num_explored > 0)
+		# sub-programs are evaluated within the evaluation of their parents, 
+		# the self time of a stage excludes its nested stages
+		eval_profiler = profiler.Profiler()
+		with profiler.activate(eval_profiler):
+			CumSum(Mutate(Table(data_id=0), 1, "+", 2), 1).cached_eval(inputs)
+		eval_report = eval_profiler.report()
+		self.assertEqual(set(eval_report.keys()), set(["eval.CumSum", "eval.Mutate", "eval.Table"]))
+		self.assertTrue(eval_report["eval.CumSum"]["time_sec"] > eval_report["eval.Mutate"]["time_sec"])
+		self.assertTrue(eval_report["eval.CumSum"]["self_time_sec"] < eval_report["eval.CumSum"]["time_sec"])
+		# nothing is recorded once the profiler is deactivated
+		Synthesizer().enumerative_synthesis(inputs, output, 1, time_limit_sec=30)
+		self.assertEqual(search_profiler.report(), report)
+
+	def test_deadline(self):
+		inputs = [[{"x": "A", "a": 1, "b": 1}, {"x": "B", "a": 2, "b": 2}]]
+		output = [{"c_x": "A", "c_y": 1}, {"c_x": "B", "c_y": 3}]
+
+		with self.assertRaises(DeadlineExceeded):
+			CumSum(Table(data_id=0), 1).eval(inputs, Deadline(-1))
+
+		# an expired deadline stops the search right away
+		synthesizer = Synthesizer()
+		sketch = CumSum(Table(data_id=0), HOLE)
+		self.assertEqual(synthesizer.synthesize_from_sketch(sketch, inputs, output, deadline=Deadline(-1)), [])
+		self.assertEqual(len(synthesizer.synthesize_from_sketch(sketch, inputs, output, deadline=Deadline(10))), 1)
+
+	def test_enumerative_synthesis_iter(self):
+		inputs = [[{"x": "A", "a": 1, "b": 1}, {"x": "B", "a": 2, "b": 2}]]
+		output = [{"c_x": "A", "c_y": 1}, {"c_x": "B", "c_y": 3}]
+
+		programs = Synthesizer().enumerative_synthesis_iter(inputs, output, 2, time_limit_sec=10)
+		first = next(programs)
+		candidates = Synthesizer().enumerative_synthesis(inputs, output, 2, time_limit_sec=10)
+		self.assertEqual(first.stmt_string(), candidates[0].stmt_string())
+
+	def test_best_first_search(self):
+		inputs = [[{"x": "A", "a": 1, "b": 1}, {"x": "B", "a": 2, "b": 2}]]
+		output = [{"c_x": "A", "c_y": 1}, {"c_x": "B", "c_y": 3}]
+
+		synthesizer = Synthesizer()
+		expected = synthesizer.enumerative_synthesis(inputs, output, 2, time_limit_sec=10)
+		for cost_model in ["size", "estimated"]:
+			config = dict(synthesizer.config, search_strategy="best_first", cost_model=cost_model)
+			candidates = Synthesizer(config).enumerative_synthesis(inputs, output, 2, time_limit_sec=10)
+			self.assertEqual(set([p.stmt_string() for p in candidates]), set([p.stmt_string() for p in expected]))
 
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
@@ -1,6 +1,10 @@
 import unittest
 
 from falx.table.language import *
+from falx.table import eval_cache
+from falx.table.execution_plan import compile_program, run_program
+from falx.table import micro_table
+from falx.table.table_shape import premise_value_sets
 import os
 
 test_data = [{"Totals":7,"Value":"A","variable":"alpha","value":2,"cumsum":2},
@@ -39,6 +43,22 @@ class TestTableLang(unittest.TestCase):
         print(q.is_abstract())
         print(q.eval(inputs=inputs) if not q.is_abstract() else "[Expression is abstract]")
 
+    def test_group_domain(self):
+        q = Select(Table(data_id=0), [0, 1, 2])
+        # (Value, variable) is a key, so it is pruned together with all its supersets
+        domain = GroupSummary(q, HOLE, HOLE, HOLE).infer_domain(1, inputs, {})
+        self.assertEqual(domain, [(0,), (1,), (2,), (0, 1), (0, 2)])
+        # wide tables: column k only repeats the value of row 2k, so every pair of columns is a key 
+        # and all groups with more than one column are pruned without a cap
+        df = pd.DataFrame([[i - 1 if i == 2 * k + 1 else i for k in range(31)] for i in range(62)])
+        q = Table(data_id=0)
+        domain = GroupSummary(q, HOLE, HOLE, HOLE).infer_domain(1, {0: df}, {})
+        self.assertEqual(domain, [(k,) for k in range(31)])
+        # groups are capped by group_max_key_list_size if it is given: column 0 is a key and is pruned
+        df = pd.DataFrame([[i] + [(i + k) % 3 for k in range(31)] for i in range(12)])
+        domain = GroupSummary(q, HOLE, HOLE, HOLE).infer_domain(1, {0: df}, {"group_max_key_list_size": 2})
+        self.assertEqual(domain, [g for size in [1, 2] for g in itertools.combinations(range(1, 32), size)])
+
     def test_unite(self):
         q = Table(data_id=0)
         q = Unite(q, 1, 2)
@@ -71,6 +91,15 @@ class TestTableLang(unittest.TestCase):
         print(q.stmt_string())
         #print(q.eval(inputs=inputs))
 
+    def test_spread_domain(self):
+        q = Select(Table(data_id=0), [1, 2, 3])
+        self.assertEqual(Spread(q, HOLE, HOLE).infer_domain(1, inputs, {}), [0, 1])
+        df = q.eval(inputs=inputs)
+        for key in range(3):
+            domain = Spread(q, key, HOLE).infer_domain(2, inputs, {})
+            self.assertEqual(domain, spread_value_domain_by_tuples(df, key))
+        self.assertEqual(Spread(q, 1, HOLE).infer_domain(2, inputs, {}), [2])
+
     def test_gather(self):
         q = Table(data_id=0)
         q = Select(q, [1, 2, 3])
@@ -115,5 +144,87 @@ class TestTableLang(unittest.TestCase):
         print(q.stmt_string())
         #print(q.eval(inputs=inputs))
 
+    def test_eval_cache(self):
+        q = Table(data_id=0)
+        q = Select(q, [1, 2, 3])
+        q = Spread(q, 1, 2)
+        cache = eval_cache.EvalCache()
+        with eval_cache.activate(cache):
+            t1 = q.cached_eval(inputs=inputs)
+            t2 = Spread(Select(Table(data_id=0), [1, 2, 3]), 1, 2).cached_eval(inputs=inputs)
+        self.assertTrue(t1 is t2)
+        self.assertTrue(t1.equals(q.eval(inputs=inputs)))
+        self.assertEqual(cache.hits, 1)
+
+    def test_cached_output_info(self):
+        q = Spread(Select(Table(data_id=0), [1, 2, 3]), 1, 2)
+        cache = eval_cache.EvalCache()
+        with eval_cache.activate(cache):
+            s1 = q.cached_output_info(inputs=inputs)
+            s2 = Spread(Select(Table(data_id=0), [1, 2, 3]), 1, 2).cached_output_info(inputs=inputs)
+        self.assertEqual(s1, q.infer_output_info(inputs=inputs))
+        self.assertEqual(s1, s2)
+        # the schema is stored in the cache, and a stored schema is reused instead of inferred again
+        key = cache.make_key(q, inputs)
+        self.assertEqual(cache.get_schema(key), s1)
+        cache.put_schema(key, ["cached"])
+        with eval_cache.activate(cache):
+            self.assertEqual(q.cached_output_info(inputs=inputs), ["cached"])
+
+    def test_execution_plan(self):
+        t = Table(data_id=0)
+        programs = [Select(t, [1, 2, 3]), Mutate(CumSum(Unite(t, 1, 2), 1), 0, "+", 2), 
+                    Separate(Unite(t, 1, 2), 3), Gather(Unite(t, 1, 2), [0, 1]), 
+                    CumSum(Spread(Select(t, [1, 2, 3]), 1, 2), 1), GroupSummary(Unite(t, 1, 2), [3], 0, "sum")]
+        for q in programs:
+            expected = q.eval(inputs=inputs)
+            result = compile_program(q).execute(inputs)
+            self.assertTrue(result.equals(expected))
+            self.assertEqual(list(result.columns), list(expected.columns))
+            self.assertTrue(run_program(q, inputs).equals(expected))
+
+    def test_output_shape(self):
+        t = Table(data_id=0)
+        programs = [Select(t, [1, 2, 3]), Spread(Select(t, [1, 2, 3]), 1, 2), Gather(Select(t, [1, 2, 3]), [0, 2]),
+                    GroupSummary(t, [1], 4, "sum"), CumSum(t, 3), Mutate(t, 0, "-", 3), Unite(t, 1, 2)]
+        for q in programs:
+            shape, df = q.infer_output_shape(inputs), q.eval(inputs)
+            self.assertEqual(shape.names, list(df.columns))
+            self.assertTrue(len(df) <= shape.max_rows)
+            for i, c in enumerate(shape.columns):
+                if c.values is not None:
+                    self.assertEqual(c.values, set(df.iloc[:, i]))
+                if c.value_range is not None:
+                    self.assertTrue(c.value_range[0] <= df.iloc[:, i].min() and df.iloc[:, i].max() <= c.value_range[1])
+        # spread creates a column per key, group_sum creates a row per group
+        shape = programs[1].infer_output_shape(inputs)
+        self.assertEqual(shape.names, ["Value", "alpha", "beta", "gamma"])
+        self.assertEqual(shape.max_rows, 5)
+        self.assertEqual(programs[3].infer_output_shape(inputs).max_rows, 5)
+        # a table of this shape never contains the value 10 (or 6 distinct values)
+        self.assertTrue(shape.may_contain(premise_value_sets(pd.DataFrame({"x": [2, 3]}))))
+        self.assertFalse(shape.may_contain(premise_value_sets(pd.DataFrame({"x": [2, 10]}))))
+        self.assertFalse(shape.may_contain(premise_value_sets(pd.DataFrame({"x": ["A", "B", "C", "D", "E", "F"]}))))
+
+    def test_micro_table(self):
+        t = Table(data_id=0)
+        programs = [Select(t, [1, 2, 3]), Spread(Select(t, [1, 2, 3]), 1, 2), Gather(Select(t, [1, 2, 3]), [0, 2]),
+                    GroupSummary(t, [1], 4, "mean"), GroupSummary(t, [1, 2], -1, "count"), 
+                    GroupSummary(Unite(t, 1, 2), [3], 0, "sum"), Separate(Unite(t, 1, 2), 3), 
+                    Mutate(CumSum(t, 3), 0, "-", 3), Filter(t, 0, "==", 7),
+                    CumSum(Gather(Spread(Select(t, [1, 2, 3]), 1, 2), [1, 2, 3]), 2)]
+        for q in programs:
+            expected = q.eval(inputs=inputs).to_dict(orient="records")
+            result = micro_table.micro_eval(q, inputs)
+            self.assertTrue(micro_table.records_equivalent(result.to_dict(orient="records"), expected))
+            self.assertTrue(micro_table.records_equivalent(result.to_df().to_dict(orient="records"), expected))
+        # results are cached separately from DataFrames
+        cache = eval_cache.EvalCache()
+        with eval_cache.activate(cache):
+            t1 = micro_table.cached_micro_eval(programs[1], inputs)
+            t2 = micro_table.cached_micro_eval(Spread(Select(Table(data_id=0), [1, 2, 3]), 1, 2), inputs)
+            self.assertTrue(isinstance(programs[1].cached_eval(inputs), pd.DataFrame))
+        self.assertTrue(t1 is t2)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from falx.benchmark import *
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_sample_trace(self):
+        path = os.path.join(BENCHMARK_DIR, "001.json")
+        with open(path, "r") as f:
+            data = json.load(f)
+        full_trace = VisDesign.load_from_vegalite(data["vl_spec"], data["output_data"]).eval()
+        # raw traces are loaded back to the same visual elements
+        self.assertTrue(same_trace(visual_trace.load_trace(visual_trace.dump_trace(full_trace)), full_trace))
+        # sampling is reproducible with the same seed
+        t1 = sample_trace(full_trace, 3, np.random.RandomState(1))
+        t2 = sample_trace(full_trace, 3, np.random.RandomState(1))
+        self.assertEqual(t1, t2)
+        self.assertTrue(visual_trace.trace_contain(visual_trace.load_trace(t1), full_trace))
+
+    def test_run_benchmark(self):
+        result = run_benchmark(os.path.join(BENCHMARK_DIR, "001.json"), {"time_limit_sec": 10}, 4, 2019)
+        self.assertTrue(result["solved"])
+        self.assertTrue(result["num_explored"] > 0)
+
+    def test_run_benchmark_in_process(self):
+        previous_hash_seed = os.environ.pop("PYTHONHASHSEED", None)
+        try:
+            result = run_benchmark_in_process(os.path.join(BENCHMARK_DIR, "001.json"), {"time_limit_sec": 10}, 4, 2019)
+            self.assertTrue(result["solved"])
+            # the hash seed is only set for the benchmark process
+            self.assertFalse("PYTHONHASHSEED" in os.environ)
+        finally:
+            if previous_hash_seed is not None:
+                os.environ["PYTHONHASHSEED"] = previous_hash_seed
+
+    def test_compare_results(self):
+        base = {"results": [{"data_id": "a", "solved": True, "time": 1.0, "peak_memory_mb": 100},
+                            {"data_id": "b", "solved": True, "time": 1.0, "peak_memory_mb": 100},
+                            {"data_id": "c", "solved": False, "status": "unsolved"}]}
+        new = {"results": [{"data_id": "a", "solved": False, "status": "killed"},
+                           {"data_id": "b", "solved": True, "time": 3.0, "peak_memory_mb": 100},
+                           {"data_id": "c", "solved": True, "time": 1.0, "peak_memory_mb": 100}]}
+        regressions, improvements = compare_results(base, new)
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(improvements, ["c: newly solved"])
+        self.assertEqual(compare_results(base, base), ([], []))
+
+if __name__ == '__main__':
+    unittest.main()
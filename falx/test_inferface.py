@@ -83,6 +83,131 @@ class TestFalxInterface(unittest.TestCase):
         for ptable, vis_design in candidates:
             print(ptable)
             print(json.dumps(json.loads(vis_design.to_vl_json())))
+    def test_synthesize_iter(self):
+
+        inputs = [[
+          { "Bucket": "Bucket E", "Budgeted": 100, "Actual": 115 },
+          { "Bucket": "Bucket D", "Budgeted": 100, "Actual": 90 },
+          { "Bucket": "Bucket C", "Budgeted": 125, "Actual": 115 },
+          { "Bucket": "Bucket B", "Budgeted": 125, "Actual": 140 },
+          { "Bucket": "Bucket A", "Budgeted": 140, "Actual": 150 }
+        ]]
+
+        vtrace = [
+          {"type": "bar", "props": { "x": "Actual", "y": 115,  "color": "Actual", "x2": "", "y2": "", "column": "Bucket E"}},
+          {"type": "bar", "props": { "x": "Actual", "y": 90,"color": "Actual", "x2": "", "y2": "", "column": "Bucket D"}},
+          {"type": "bar", "props": { "x": "Budgeted","y": 100,  "color": "Budgeted", "x2": "", "y2": "", "column": "Bucket D"}},
+        ]
+
+        # the first result is available without waiting for the whole search
+        ptable, vis_design = next(FalxInterface.synthesize_iter(inputs=inputs, raw_trace=vtrace))
+        candidates = FalxInterface.synthesize(inputs=inputs, raw_trace=vtrace)
+        self.assertEqual(ptable, candidates[0][0])
+        print(vis_design.to_vl_json())
+
+    def test_synthesis_session(self):
+
+        inputs = [[
+          { "Bucket": "Bucket E", "Budgeted": 100, "Actual": 115 },
+          { "Bucket": "Bucket D", "Budgeted": 100, "Actual": 90 },
+          { "Bucket": "Bucket C", "Budgeted": 125, "Actual": 115 },
+          { "Bucket": "Bucket B", "Budgeted": 125, "Actual": 140 },
+          { "Bucket": "Bucket A", "Budgeted": 140, "Actual": 150 }
+        ]]
+
+        vtrace = [
+          {"type": "bar", "props": { "x": "Actual", "y": 115,  "color": "Actual", "x2": "", "y2": "", "column": "Bucket E"}},
+          {"type": "bar", "props": { "x": "Actual", "y": 90,"color": "Actual", "x2": "", "y2": "", "column": "Bucket D"}},
+          {"type": "bar", "props": { "x": "Budgeted","y": 100,  "color": "Budgeted", "x2": "", "y2": "", "column": "Bucket D"}},
+        ]
+
+        session = SynthesisSession(inputs)
+        session.add_elements(vtrace[:1])
+        candidates = session.add_elements(vtrace[1:])
+        self.assertTrue(len(candidates) > 0)
+        # every remaining candidate is consistent with the whole trace
+        for _, vis_design in candidates:
+            self.assertTrue(visual_trace.trace_contain(visual_trace.load_trace(vtrace), vis_design.eval()))
+
+    def test_synthesize_profile(self):
+
+        inputs = [[
+          { "Bucket": "Bucket E", "Budgeted": 100, "Actual": 115 },
+          { "Bucket": "Bucket D", "Budgeted": 100, "Actual": 90 },
+          { "Bucket": "Bucket C", "Budgeted": 125, "Actual": 115 }
+        ]]
+
+        vtrace = [
+          {"type": "bar", "props": { "x": "Actual", "y": 115,  "color": "Actual", "x2": "", "y2": "", "column": "Bucket E"}},
+          {"type": "bar", "props": { "x": "Budgeted","y": 100,  "color": "Budgeted", "x2": "", "y2": "", "column": "Bucket D"}},
+        ]
+
+        candidates, report = FalxInterface.synthesize(inputs=inputs, raw_trace=vtrace, profile=True)
+        self.assertEqual([p for p, _ in candidates], [p for p, _ in FalxInterface.synthesize(inputs=inputs, raw_trace=vtrace)])
+        self.assertTrue(report["num_explored"] > 0)
+        for stage in ["inv_eval", "enum_sketches", "backward_eval", "premise_check", "align_table_schema", "vis_post_processing"]:
+            self.assertTrue(report["stages"][stage]["count"] > 0)
+
+    def test_layered_chart(self):
+
+        inputs = [[
+          { "Quarter": "Quarter1", "Number of Units": 23, "Actual Profits": 3358 },
+          { "Quarter": "Quarter2", "Number of Units": 27, "Actual Profits": 3829 },
+          { "Quarter": "Quarter3", "Number of Units": 15, "Actual Profits": 2374 },
+          { "Quarter": "Quarter4", "Number of Units": 43, "Actual Profits": 3373 }
+        ]]
+
+        vtrace = [
+          {"type": "line", "props": {"x1": "Quarter2", "y1": 27, "x2": "Quarter3", "y2": 15}},
+          {"type": "bar", "props": {"x": "Quarter4", "y": 3373}},
+          {"type": "bar", "props": {"x": "Quarter1", "y": 3358}}
+        ]
+
+        # layers are synthesized concurrently, stages of all layers are profiled
+        candidates, report = FalxInterface.synthesize(inputs=inputs, raw_trace=vtrace, profile=True)
+        self.assertTrue(len(candidates) > 0)
+        self.assertTrue(report["stages"]["backward_eval"]["count"] >= 2)
+        for tbl_progs, vis_design in candidates:
+            self.assertEqual(len(tbl_progs), 2)
+            self.assertTrue(visual_trace.trace_contain(visual_trace.load_trace(vtrace), vis_design.eval()))
+
+        # with worker processes, sketches of all layers are explored by the worker pool at the same time
+        parallel_candidates, report = FalxInterface.synthesize(inputs=inputs, raw_trace=vtrace, 
+                                                               config={"num_workers": 2}, profile=True)
+        self.assertEqual([tbl_progs for tbl_progs, _ in parallel_candidates], [tbl_progs for tbl_progs, _ in candidates])
+        self.assertTrue(report["stages"]["backward_eval"]["count"] >= 2)
+
+    def test_ranked_combinations(self):
+        combinations = list(FalxInterface.ranked_combinations([2, 3]))
+        self.assertEqual(combinations, [(0, 0), (0, 1), (1, 0), (0, 2), (1, 1), (1, 2)])
+        self.assertEqual(sorted(combinations), sorted(itertools.product(range(2), range(3))))
+        # combinations are generated lazily up to the limit
+        self.assertEqual(list(FalxInterface.ranked_combinations([10] * 5, limit=3)), 
+                         [(0, 0, 0, 0, 0), (0, 0, 0, 0, 1), (0, 0, 0, 1, 0)])
+        self.assertEqual(list(FalxInterface.ranked_combinations([2, 0])), [])
+
+    def test_group_results(self):
+
+        data = [{"x": "A", "y": 1}, {"x": "B", "y": 2}]
+        chart = BarChart(encodings=[Encoding("x", "x", "nominal"), Encoding("y", "y", "quantitative")], orientation="vertical")
+        results = [("p1", VisDesign(data=data, chart=chart)), 
+                   ("p2", VisDesign(data=list(reversed(data)), chart=chart)), 
+                   ("p3", VisDesign(data=[{"x": "A", "y": 1}, {"x": "B", "y": 3}], chart=chart))]
+
+        # traces with the same elements in different orders are equivalent
+        groups = FalxInterface.group_results(results)
+        self.assertEqual(sorted([[p for p, _ in g] for g in groups.values()]), [["p1", "p2"], ["p3"]])
+        # traces are evaluated in worker processes
+        self.assertEqual(FalxInterface.group_results(results, num_workers=2).keys(), groups.keys())
+
+        # traces with colliding hashes are compared element by element
+        multiset_hash = visual_trace.multiset_hash
+        try:
+            visual_trace.multiset_hash = lambda multiset: 0
+            groups = FalxInterface.group_results(results)
+        finally:
+            visual_trace.multiset_hash = multiset_hash
+        self.assertEqual(sorted([[p for p, _ in g] for g in groups.values()]), [["p1", "p2"], ["p3"]])
 
 if __name__ == '__main__':
     unittest.main()
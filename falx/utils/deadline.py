@@ -0,0 +1,38 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """raised by long running synthesis steps once their deadline has passed (or they are cancelled)"""
+    pass
+
+
+class Deadline(object):
+    """A deadline / cancellation token passed through domain inference, evaluation and table alignment.
+        Args:
+            time_limit_sec: seconds from now until the deadline (None means no time limit)
+            is_cancelled: an optional function that returns True if the work should be abandoned
+    """
+    def __init__(self, time_limit_sec=None, is_cancelled=None):
+        self.end_time = time.time() + time_limit_sec if time_limit_sec is not None else None
+        self.is_cancelled = is_cancelled
+
+    def remaining(self):
+        """remaining time in seconds (None if there is no time limit)"""
+        if self.end_time is None:
+            return None
+        return self.end_time - time.time()
+
+    def expired(self):
+        if self.is_cancelled is not None and self.is_cancelled():
+            return True
+        return self.end_time is not None and time.time() > self.end_time
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded()
+
+
+def check_deadline(deadline):
+    """raise DeadlineExceeded if the deadline (which can be None) has passed"""
+    if deadline is not None:
+        deadline.check()
@@ -0,0 +1,102 @@
+import threading
+import contextlib
+import time
+
+
+# the profiler that records stages in the current thread (None means profiling is disabled)
+_state = threading.local()
+
+
+def get_active_profiler():
+    """return the profiler that is active in the current thread (or None)"""
+    return getattr(_state, "profiler", None)
+
+
+@contextlib.contextmanager
+def activate(profiler):
+    """make the profiler record stages run in the current thread within the context"""
+    previous = get_active_profiler()
+    _state.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _state.profiler = previous
+
+
+class _NullStage(object):
+    """the stage returned by profile() when profiling is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+
+    __slots__ = ["profiler", "name"]
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.profiler.exit()
+        return False
+
+
+def profile(stage, detail=None):
+    """a context manager that counts and times a stage with the active profiler,
+        the stage is named "stage.detail" if detail (e.g., an operator name) is given;
+        it does nothing (and costs a thread local lookup) if no profiler is active"""
+    profiler = getattr(_state, "profiler", None)
+    if profiler is None:
+        return _NULL_STAGE
+    return _Stage(profiler, stage if detail is None else stage + "." + detail)
+
+
+class Profiler(object):
+    """Counts and times stages of a synthesis request (see profile).
+        Stages can be nested: the time of a stage includes the stages it runs,
+        and its self time excludes them (so that self times of all stages add up to the profiled time).
+    """
+
+    def __init__(self):
+        # stage name -> [count, time, self time]
+        self.stages = {}
+        # running stages: [name, start time, time spent in nested stages]
+        self._stack = []
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, start, nested_time = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += elapsed - nested_time
+        if len(self._stack) > 0:
+            self._stack[-1][2] += elapsed
+
+    def merge(self, report):
+        """add a report (e.g., from a worker process) to this profiler"""
+        for name, stats in report.items():
+            entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += stats["count"]
+            entry[1] += stats["time_sec"]
+            entry[2] += stats["self_time_sec"]
+
+    def report(self):
+        """the statistics of all stages, sorted by self time"""
+        names = sorted(self.stages, key=lambda name: -self.stages[name][2])
+        return {name: {"count": self.stages[name][0], "time_sec": self.stages[name][1],
+                       "self_time_sec": self.stages[name][2]} for name in names}
@@ -1,69 +1,129 @@
 import json
-import itertools
+import collections
+import hashlib
 import numpy as np
 
 import pandas as pd
 
+from falx.utils.deadline import check_deadline
+
 def remove_duplicate_columns(df):
-    """Given a pandas table deuplicate column duplicates"""
-    to_drop = []
-    col_num = len(df.columns)
-    
-    for i, c1 in enumerate(df.columns):
-        c1 = df.columns[i]
-        if c1 in to_drop: continue
+    """Given a pandas table deuplicate column duplicates
+        columns are bucketed by a content key and only compared with columns in the same bucket
+        (columns of mixed objects have no key and are compared with all columns)"""
+    if len(df) == 0:
+        # all empty columns are equal
+        return df[list(df.columns[:1])]
 
-        for j, c2 in enumerate(df.columns):    
-            if i >= j: continue
-            if tuple(df[c1]) == tuple(df[c2]):
-                to_drop.append(c2)
+    to_drop = []
+    kept, buckets, kept_without_key = [], {}, []
+    for j, c2 in enumerate(df.columns):
+        col = df.iloc[:, j]
+        key = column_content_key(col)
+        if key is None:
+            candidates = kept
+        else:
+            candidates = buckets.get(key, []) + kept_without_key
+
+        if any([tuple(df.iloc[:, i]) == tuple(col) for i in candidates]):
+            to_drop.append(c2)
+            continue
+
+        kept.append(j)
+        if key is None:
+            kept_without_key.append(j)
+        else:
+            buckets.setdefault(key, []).append(j)
 
     ret_table = df[[c for c in df.columns if c not in to_drop]]
     return ret_table
 
 
-def check_table_inclusion(table1, table2, wild_card=None):
+def column_content_key(col):
+    """a hashable key of the column content, equal columns (compared value by value) always have the same key,
+        numbers are keyed by their float64 representation (so that 1 and 1.0 match), strings by their hashes,
+        returns None for other columns"""
+    if col.dtype.kind in "biuf":
+        # adding 0.0 turns -0.0 into 0.0
+        return ("number", (col.to_numpy(dtype=np.float64) + 0.0).tobytes())
+    if col.dtype.kind == "O" and all([isinstance(v, str) for v in col]):
+        return ("string", pd.util.hash_pandas_object(col, index=False).values.tobytes())
+    return None
+
+
+def table_fingerprint(df):
+    """compute a content fingerprint of a dataframe (column names, dtypes, index and values)"""
+    if not isinstance(df, (pd.DataFrame,)):
+        # tables of other backends (see falx.table.micro_table) compute their own fingerprint
+        return df.fingerprint()
+    h = hashlib.sha1()
+    h.update(json.dumps([[str(c), str(t)] for c, t in zip(df.columns, df.dtypes)]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def check_table_inclusion(table1, table2, wild_card=None, deadline=None):
     """check if table1 is included by table2 (projection + subset), 
         this is sound but not complete: 
             if it thinks two tables are not equal, they absolutely inequal, 
-        tables are records"""
+        tables are records (DeadlineExceeded is raised if the optional deadline passes)"""
     if len(table1) == 0:
         return True
-
-    mapping = {}
-    vals2_dicts = {}
-    for k2 in table2[0].keys():
-        vals2_dicts[k2] = construct_value_dict([r[k2] for r in table2 if k2 in r])
-    
-    for k1 in table1[0].keys():
-        mapping[k1] = []
-        vals1_dict = construct_value_dict([r[k1] for r in table1 if k1 in r])
-        for k2 in table2[0].keys():
-            vals2_dict = vals2_dicts[k2]
-            contained = True
-            for x in vals1_dict:
-
-                if wild_card != None and x == wild_card:
-                    # we consider this x value matches anything
-                    continue
-
-                if x not in vals2_dict:
-                    contained = False
-                if contained == False:
-                    break
-            if contained:
-                mapping[k1].append(k2)
-
-    # distill plausible mappings from the table
-    # not all choices generated from the approach above generalize, we need to check consistency
-    t1_schema = list(mapping.keys())
-    mapping_id_lists = [list(range(len(mapping[key]))) for key in t1_schema]
-    check_ok = all([len(l) > 0 for l in mapping_id_lists])
-    return check_ok
+    return PremiseIndex(table1, wild_card).included_by(column_value_sets(table2, deadline), deadline)
+
+
+def table_columns(table):
+    """the columns of a table given by records or a dataframe (or a table of another backend, see micro_table)"""
+    if isinstance(table, (pd.DataFrame,)):
+        return [col.tolist() for _, col in table.items()]
+    if isinstance(table, (list,)):
+        if len(table) == 0:
+            return []
+        return [[r[k] for r in table if k in r] for k in table[0].keys()]
+    return table.cols
+
+
+def column_value_sets(table, deadline=None):
+    """the normalized values in each column of a table (see construct_value_dict)"""
+    value_sets = []
+    for col in table_columns(table):
+        check_deadline(deadline)
+        value_sets.append(construct_value_dict(col).keys())
+    return value_sets
+
+
+class PremiseIndex(object):
+    """A table compiled for repeated inclusion checks (see check_table_inclusion): 
+        normalized values in its columns (without the wild card) are computed once, 
+        so that a check only needs to normalize the columns of the other table"""
+
+    def __init__(self, table, wild_card=None):
+        self.num_rows = len(table)
+        self.value_sets = []
+        for vals in column_value_sets(table):
+            if wild_card != None:
+                # we consider the wild card value matches anything
+                vals = vals - set([wild_card])
+            self.value_sets.append(vals)
+
+    def included_by(self, value_sets2, deadline=None):
+        """check if the table is included by a table given by its column_value_sets: 
+            values in each column should be contained by some column of the other table"""
+        if self.num_rows == 0:
+            return True
+        for vals1 in self.value_sets:
+            check_deadline(deadline)
+            if not any([vals1 <= vals2 for vals2 in value_sets2]):
+                return False
+        return True
 
 
-def align_table_schema(table1, table2, check_equivalence=False, boolean_result=False):
-    """align table schema, assume that table1 is contained by table2"""
+def align_table_schema(table1, table2, check_equivalence=False, boolean_result=False, deadline=None):
+    """align table schema, assume that table1 is contained by table2
+        (DeadlineExceeded is raised if the optional deadline passes)
+        Each column of table1 can be mapped to columns of table2 whose values contain its values (as multisets),
+        a consistent mapping is then searched column by column, in the order of enumerating all mapping choices,
+        and partial mappings are pruned by bipartite matching and by comparing row multisets of mapped columns"""
     if len(table1) > len(table2):
         # cannot find any mapping
         return None
@@ -77,69 +137,142 @@ def align_table_schema(table1, table2, check_equivalence=False, boolean_result=F
         vals2_dicts[k2] = construct_value_dict([r[k2] for r in table2 if k2 in r])
 
     for k1 in table1[0].keys():
+        check_deadline(deadline)
         mapping[k1] = []
         vals1_dict = construct_value_dict([r[k1] for r in table1 if k1 in r])
         for k2 in table2[0].keys():
             vals2_dict = vals2_dicts[k2]
-            contained = True
-            for x in vals1_dict:
-                if (x not in vals2_dict) or (vals2_dict[x] < vals1_dict[x]):
-                    contained = False
-                if check_equivalence and (x not in vals2_dict or vals2_dict[x] != vals1_dict[x]):
-                    contained = False
-                if contained == False:
-                    break
-            if contained and check_equivalence:
-                for x in vals2_dict:
-                    if x not in vals1_dict:
-                        contained = False
-                        break
-
+            if check_equivalence:
+                contained = vals1_dict == vals2_dict
+            else:
+                contained = (vals1_dict.keys() <= vals2_dict.keys() 
+                                and all([vals2_dict[x] >= cnt for x, cnt in vals1_dict.items()]))
             if contained:
                 mapping[k1].append(k2)
-    
-    #print(mapping)
+
+    t1_schema = list(mapping.keys())
+
+    if boolean_result: return all([len(mapping[key]) > 0 for key in t1_schema])
 
     # distill plausible mappings from the table
     # not all choices generated from the approach above generalize, we need to check consistency
-    t1_schema = list(mapping.keys())
-    mapping_id_lists = [list(range(len(mapping[key]))) for key in t1_schema]
+    cols1 = {key: [normalize_value(r[key]) if key in r else MISSING for r in table1] for key in t1_schema}
+    cols2 = {key: [normalize_value(r[key]) if key in r else MISSING for r in table2] for key in table2[0].keys()}
+
+    # rows are compared on the values they have (absent keys are skipped), 
+    # since such rows can't be compared column by column, partial mappings of ragged tables are not pruned
+    ragged = any([MISSING in col for col in list(cols1.values()) + list(cols2.values())])
+
+    # columns of table1 with different values can never be mapped to the same column of table2
+    # (the row multiset check would require them to be equal row by row), 
+    # so distinct column classes should be matched to different columns of table2
+    column_class = {}
+    for key in t1_schema:
+        column_class[key] = next(k for k in t1_schema if cols1[k] == cols1[key])
+
+    def remaining_classes_matchable(inst):
+        if ragged:
+            return True
+        used = set(inst.values())
+        assigned_classes = set([column_class[key] for key in inst])
+        classes = [c for c in t1_schema if column_class[c] == c and c not in assigned_classes]
+        return has_complete_matching(classes, {c: [k2 for k2 in mapping[c] if k2 not in used] for c in classes})
+
+    def rows_contained(inst):
+        keys = list(inst.keys())
+        if len(keys) == 0 or (ragged and len(keys) < len(t1_schema)):
+            return True
+        counter1 = collections.Counter([tuple([v for v in row if v is not MISSING]) 
+                                            for row in zip(*[cols1[key] for key in keys])])
+        counter2 = collections.Counter([tuple([v for v in row if v is not MISSING]) 
+                                            for row in zip(*[cols2[inst[key]] for key in keys])])
+        return all([counter2[t] >= cnt for t, cnt in counter1.items()])
+
+    def search(inst):
+        if len(inst) == len(t1_schema):
+            return inst
+        key = t1_schema[len(inst)]
+        for k2 in mapping[key]:
+            check_deadline(deadline)
+            if not ragged and any([k2 == inst[k] and column_class[k] != column_class[key] for k in inst]):
+                continue
+            new_inst = dict(inst)
+            new_inst[key] = k2
+            if rows_contained(new_inst) and remaining_classes_matchable(new_inst):
+                result = search(new_inst)
+                if result is not None:
+                    return result
+        return None
+
+    if not remaining_classes_matchable({}):
+        return None
 
-    all_choices = list(itertools.product(*mapping_id_lists))
+    return search({})
 
-    if boolean_result: return len(all_choices) > 0
 
-    # directly return if there is only one choice, !!!should still check it to ensure correctness
-    #if len(all_choices) == 1:
-    #    return {key:mapping[key][0] for key in mapping}
+# the value of a key that is absent from a row (see align_table_schema)
+MISSING = object()
 
-    for mapping_id_choices in all_choices:
-        # the following is an instantiation of the the mapping
-        inst = { t1_schema[i]:mapping[t1_schema[i]][mapping_id_choices[i]] for i in range(len(t1_schema))}
 
-        def value_handling_func(val):
-            if isinstance(val, (int, str,)):
-                return val
-            try:
-                val = float(val)
-                val = np.round(val, 5)
-            except:
-                pass
-            return val
+def normalize_value(val):
+    """normalize values for comparison: ints and strings are kept, other numbers are rounded to 5 digits"""
+    if isinstance(val, (int, str,)):
+        return val
+    try:
+        val = float(val)
+        val = np.round(val, 5)
+    except:
+        pass
+    return val
 
-        # distill the tables for checking
-        frozen_table1 = [tuple([value_handling_func(r[key]) for key in t1_schema if key in r]) for r in table1]
-        frozen_table2 = [tuple([value_handling_func(r[inst[key]]) for key in t1_schema if inst[key] in r]) for r in table2]
 
-        if all([frozen_table1.count(t) <= frozen_table2.count(t) for t in frozen_table1]):
-            return inst
+def has_complete_matching(left, edges):
+    """check if every node in left can be matched to a distinct node it has an edge to (edges[node] is a list), 
+        by finding augmenting paths (Kuhn's algorithm)"""
+    match = {}
 
-    return None
+    def augment(u, visited):
+        for v in edges[u]:
+            if v in visited:
+                continue
+            visited.add(v)
+            if v not in match or augment(match[v], visited):
+                match[v] = u
+                return True
+        return False
+
+    return all([augment(u, set()) for u in left])
 
 
 def construct_value_dict(values):
-    new_values = []
+    """count values in a column (numbers are rounded to 5 digits, other values are kept as they are),
+        numeric and string columns are normalized as a whole, and strings are only converted per distinct value"""
     values = np.array(values)
+
+    if values.dtype.kind in "biuf":
+        values = np.round(values.astype(np.float64), 5)
+        if not np.isnan(values).any():
+            uniques, counts = np.unique(values, return_counts=True)
+            return dict(zip(uniques, counts.tolist()))
+    elif values.dtype.kind == "U":
+        uniques, counts = np.unique(values, return_counts=True)
+        value_dict = {}
+        for x, cnt in zip(normalize_column_values(uniques), counts.tolist()):
+            value_dict[x] = value_dict.get(x, 0) + cnt
+        return value_dict
+
+    # object columns (and numbers with NaN, which are compared by identity) are counted value by value
+    value_dict = {}
+    for x in normalize_column_values(values):
+        if not x in value_dict:
+            value_dict[x] = 0
+        value_dict[x] += 1
+    return value_dict
+
+
+def normalize_column_values(values):
+    """round values of a numpy array that can be converted to numbers, and keep other values"""
+    new_values = []
     for v in values:
         try:
             v = v.astype(np.float64)
@@ -147,15 +280,7 @@ def construct_value_dict(values):
             new_values.append(v)
         except:
             new_values.append(v)
-
-    values = new_values
-
-    value_dict = {}
-    for x in values:
-        if not x in value_dict:
-            value_dict[x] = 0
-        value_dict[x] += 1
-    return value_dict
+    return new_values
 
 
 def update_search_grammar(extra_consts, in_file, out_file):
@@ -1,5 +1,6 @@
 from namedlist import namedlist
 from pprint import pprint
+from collections import Counter
 
 # mutatable vtrace
 BarV = namedlist("BarV", ["x", "y1", "y2", "color", "column"], default=None)
@@ -22,9 +23,27 @@ def partition_trace(vtrace):
         partition[vty].append(v)
     return partition
 
+def freeze_element(v):
+    """a hashable representation of a visual element, 
+        numbers are rounded so that values computed by table programs match values in the trace"""
+    return (get_vt_type(v),) + tuple([round(x, 5) if isinstance(x, float) else x for x in v])
+
+def trace_multiset(vtrace):
+    """the multiset (a Counter) of frozen visual elements of a trace"""
+    return Counter([freeze_element(v) for v in vtrace])
+
+def multiset_hash(multiset):
+    """an order-independent hash of a multiset of elements (see trace_multiset), 
+        equal multisets have equal hashes (within a process, as string hashes are salted)"""
+    return sum([hash(item) for item in multiset.items()]) & 0xFFFFFFFFFFFFFFFF
+
 def trace_contain(tr1, tr2):
-    """check whether tr1 is contained by tr2 """
-    pass
+    """check whether tr1 is contained by tr2 (both are treated as multisets of visual elements)"""
+    cnt2 = trace_multiset(tr2)
+    for key, cnt in trace_multiset(tr1).items():
+        if cnt2[key] < cnt:
+            return False
+    return True
 
 def load_trace(raw_trace):
     """Given a trace represnted as a dictionary, 
@@ -35,7 +54,8 @@ def load_trace(raw_trace):
         get_prop = lambda k: None if (k not in trace_dict["props"] or trace_dict["props"][k] == "") else trace_dict["props"][k]
 
         if trace_dict["type"] == "bar":
-            if get_prop("x2") != None:
+            # horizontal bars starting from 0 have no x2, they are marked by "orient"
+            if get_prop("x2") != None or get_prop("orient") == "horizontal":
                 return BarH(x1=get_prop("x"), x2=get_prop("x2"), y=get_prop("y"), color=get_prop("color"), column=get_prop("column"))
             else:
                 return BarV(x=get_prop("x"), y1=get_prop("y"), y2=get_prop("y2"), color=get_prop("color"), column=get_prop("column"))
@@ -54,6 +74,30 @@ def load_trace(raw_trace):
     return [convert_one(tr) for tr in raw_trace]
 
 
+def dump_trace(vtrace):
+    """The inverse of load_trace: represent visual elements as dictionaries,
+        empty properties are omitted"""
+
+    def convert_one(v):
+        ty = get_vt_type(v)
+        if ty == "BarV":
+            ty, props = "bar", {"x": v.x, "y": v.y1, "y2": v.y2, "color": v.color, "column": v.column}
+        elif ty == "BarH":
+            ty, props = "bar", {"x": v.x1, "x2": v.x2, "y": v.y, "color": v.color, "column": v.column, 
+                                "orient": "horizontal" if v.x2 is None else None}
+        elif ty == "Point":
+            ty, props = v.point_shape if v.point_shape is not None else "point", {"x": v.x, "y": v.y, "shape": v.shape, "size": v.size, "color": v.color, "column": v.column}
+        elif ty == "Line":
+            ty, props = "line", dict(v._asdict())
+        elif ty == "Area":
+            ty, props = "area", {"x_left": v.x1, "y_top_left": v.yt1, "y_bot_left": v.yb1, "x_right": v.x2, 
+                                 "y_top_right": v.yt2, "y_bot_right": v.yb2, "color": v.color, "column": v.column}
+        else:
+            raise ValueError(f"[dump_trace] {ty} elements cannot be loaded by load_trace.")
+        return {"type": ty, "props": {k: val for k, val in props.items() if val is not None}}
+    return [convert_one(v) for v in vtrace]
+
+
 def trace_to_table(vtrace):
     trace_dict = partition_trace(vtrace)
     for ty in trace_dict: